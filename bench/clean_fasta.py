@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time the original pbcore FastaReader clean_fasta and the FastaIndex one
+that replaced it against the streaming utils.clean_stream and
+utils.clean_fasta_parallel, checking all keep the same records
+
+    python bench/clean_fasta.py [--records 60000] [--length 5000] [--nproc 4]
+
+The pbcore version is only timed when pbcore is installed.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+
+try:
+    import pbcore.io.FastaIO as fi
+except ImportError:
+    fi = None
+
+from falcon_tools import utils
+from falcon_tools.fasta import FastaIndex
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# fraction of records without a sequence
+EMPTY = 0.02
+# fraction of records followed by a blank line
+BLANK = 0.01
+WIDTH = 80
+
+
+def synthetic_fasta(path, records, length, seed=1):
+    """A wrapped fasta with some empty records and blank lines"""
+    rng = random.Random(seed)
+    pool = ''.join(rng.choice('ACGT') for _ in range(length * 4)).encode()
+    with open(path, 'wb') as outfile:
+        for idx in range(records):
+            outfile.write(">m54006_{i:06d}/ccs\n".format(i=idx).encode())
+            if rng.random() >= EMPTY:
+                size = rng.randint(length // 2, length * 3 // 2)
+                start = rng.randrange(len(pool) - size)
+                sequence = pool[start:start + size]
+                outfile.write(b''.join(
+                    sequence[pos:pos + WIDTH] + b'\n'
+                    for pos in range(0, size, WIDTH)))
+            if rng.random() < BLANK:
+                outfile.write(b'\n')
+
+
+def pbcore_clean(fastafile, output):
+    """clean_fasta before FastaIndex: one FastaReader record at a time"""
+    reads = fi.FastaReader(fastafile)
+    with open(output, 'w') as outfile:
+        for record in reads:
+            if record.sequence:
+                outfile.write('>{r}\n{s}\n'.format(
+                    r=record.header, s=record.sequence))
+
+
+def index_clean(fastafile, output):
+    """clean_fasta before clean_stream: records read through a FastaIndex"""
+    index = FastaIndex.build(fastafile)
+    with open(output, 'wb') as outfile:
+        for record in index:
+            header = index.header(record)
+            if record.length:
+                outfile.write(b'>' + header + b'\n')
+                outfile.write(index.sequence(record) + b'\n')
+    index.close()
+
+
+def stream_clean(fastafile, output):
+    with open(fastafile, 'rb') as infile:
+        with open(output, 'wb') as outfile:
+            utils.clean_stream(infile, outfile, log, dropped=[])
+
+
+def parallel_clean(fastafile, output, nproc):
+    with open(output, 'wb') as outfile:
+        utils.clean_fasta_parallel(fastafile, outfile, log, nproc)
+
+
+def records(path):
+    """(header, unwrapped sequence) of every record of a fasta"""
+    result = []
+    with open(path, 'rb') as infile:
+        for line in infile:
+            line = line.rstrip()
+            if line.startswith(b'>'):
+                result.append((line[1:], []))
+            elif line:
+                result[-1][1].append(line)
+
+    return [(header, b''.join(lines)) for header, lines in result]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--records", type=int, default=60000,
+                        help="records in the synthetic fasta")
+    parser.add_argument("--length", type=int, default=5000,
+                        help="mean sequence length")
+    parser.add_argument("--nproc", type=int, default=4,
+                        help="processes of clean_fasta_parallel")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_clean.', dir=os.getcwd())
+    try:
+        fastafile = os.path.join(tmpdir, 'reads.fa')
+        synthetic_fasta(fastafile, args.records, args.length)
+        size = os.path.getsize(fastafile) / 1e6
+
+        runs = []
+        if fi is not None:
+            runs.append(("pbcore FastaReader", pbcore_clean, ()))
+        else:
+            print("pbcore is not installed, skipping the FastaReader version")
+        runs.extend([("FastaIndex", index_clean, ()),
+                      ("clean_stream", stream_clean, ()),
+                      ("clean_fasta_parallel, {n} processes".format(
+                          n=args.nproc), parallel_clean, (args.nproc,))])
+
+        expected = None
+        print("{n} records, {s:.0f} MB".format(n=args.records, s=size))
+        for name, func, extra in runs:
+            output = os.path.join(tmpdir, 'cleaned.fa')
+            start = time.time()
+            func(fastafile, output, *extra)
+            elapsed = time.time() - start
+
+            kept = records(output)
+            if expected is None:
+                expected = kept
+            elif kept != expected:
+                sys.exit("{n}: records differ".format(n=name))
+            print("{n}: {t:.2f}s, {r:.0f} MB/s".format(
+                n=name, t=elapsed, r=size / elapsed))
+            os.remove(output)
+        print("{k} records kept by all".format(k=len(expected)))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Check falcon_tools.intervals against the original endpoint-sweep merge of
+get_homologs, then time both
+
+    python bench/merge_intervals.py [--sets 3000] [--sizes 100000 1000000]
+"""
+
+import sys
+import time
+import random
+import argparse
+
+import numpy as np
+
+from falcon_tools import intervals
+
+
+def sweep_merge(qhits):
+    """get_homologs' endpoint-sweep merge, before falcon_tools.intervals"""
+    spans = [(int(i[0]), int(i[1])) for i in qhits]
+
+    if not spans:
+        return []
+    data = []
+    for span in spans:
+        data.append((span[0], 0))
+        data.append((span[1], 1))
+    data.sort()
+    merged = []
+    stack = [data[0]]
+    for i in range(1, len(data)):
+        datum = data[i]
+        if datum[1] == 0:
+            stack.append(datum)
+        elif datum[1] == 1:
+            if stack:
+                start = stack.pop()
+            if len(stack) == 0:
+                merged.append((start[0], datum[0]))
+    return merged
+
+
+def vector_merge(qhits):
+    """merge_intervals with the sweep merge's input and output types"""
+    if not qhits:
+        return []
+    starts, ends = zip(*[(int(i[0]), int(i[1])) for i in qhits])
+    starts, ends = intervals.merge_intervals(starts, ends)
+
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def random_hits(rng, count, span):
+    """count (start, end) hits in [1, span]; small spans force touching
+    and nested intervals"""
+    hits = []
+    for _ in range(count):
+        start = rng.randint(1, span)
+        hits.append((start, start + rng.randint(0, max(1, span // 10))))
+    return hits
+
+
+def check(nsets, seed=1):
+    """Compare both merges, alone and grouped, on random interval sets"""
+    rng = random.Random(seed)
+    groups = []
+    for _ in range(nsets):
+        hits = random_hits(rng, rng.randint(0, 40),
+                           rng.choice((10, 100, 10000)))
+        expected = sweep_merge(hits)
+        if vector_merge(hits) != expected:
+            sys.exit("merge_intervals differs on {h}".format(h=hits))
+        groups.append((hits, expected))
+
+    # Every set again as one group of a single merge_grouped call
+    sizes = [len(hits) for hits, _ in groups]
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    starts = [start for hits, _ in groups for start, _ in hits]
+    ends = [end for hits, _ in groups for _, end in hits]
+    mstarts, mends, moffsets = intervals.merge_grouped(starts, ends, offsets)
+    for idx, (_, expected) in enumerate(groups):
+        got = list(zip(mstarts[moffsets[idx]:moffsets[idx + 1]].tolist(),
+                       mends[moffsets[idx]:moffsets[idx + 1]].tolist()))
+        if got != expected:
+            sys.exit("merge_grouped differs on set {i}".format(i=idx))
+
+    print("{n} interval sets: identical results".format(n=nsets))
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def bench(sizes, ngroups, seed=2):
+    rng = random.Random(seed)
+    for size in sizes:
+        hits = random_hits(rng, size, size * 10)
+        print("merge, {n} intervals: {a:.3f}s -> {b:.3f}s".format(
+            n=size, a=timed(sweep_merge, hits), b=timed(vector_merge, hits)))
+
+    size = sizes[-1]
+    hits = random_hits(rng, size, size * 10)
+    offsets = np.linspace(0, size, ngroups + 1).astype(np.int64)
+    starts = np.array([start for start, _ in hits], dtype=np.int64)
+    ends = np.array([end for _, end in hits], dtype=np.int64)
+
+    def per_group():
+        for idx in range(ngroups):
+            sweep_merge(hits[offsets[idx]:offsets[idx + 1]])
+
+    print("{n} intervals in {g} groups: {a:.3f}s -> {b:.3f}s "
+          "(merge_grouped)".format(
+              n=size, g=ngroups, a=timed(per_group),
+              b=timed(intervals.merge_grouped, starts, ends, offsets)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--sets", type=int, default=3000,
+                        help="random interval sets to check")
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[100000, 1000000],
+                        help="interval counts to time")
+    parser.add_argument("--groups", type=int, default=500,
+                        help="groups of the merge_grouped timing")
+    args = parser.parse_args()
+
+    check(args.sets)
+    bench(args.sizes, args.groups)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time homology scoring of a synthetic show-coords table: the original
+per-query rescan of get_homologs.process_coords against
+homology.score_coords, checking both find the same homologs
+
+    python bench/process_coords.py [--rows 1000000] [--queries 100 500]
+"""
+
+import sys
+import time
+import random
+import argparse
+from collections import Counter
+
+from falcon_tools import coords as coordsutils
+from falcon_tools import homology
+
+from merge_intervals import sweep_merge
+
+REFERENCE = '000000F'
+REF_LENGTH = 5000000
+# homolog hits land in distinct TILE-sized slots of the reference
+TILE = 5000
+
+
+def synthetic_coords(rows, queries, seed=1):
+    """`show-coords -HT` lines for one reference
+
+    A self hit, then for every tenth query 40 hits: disjoint tiles for a
+    homolog, one tile hit repeatedly for a near miss (merge ratio too
+    low). The remaining rows are random hits of the other queries, a
+    third of them in overlapping clusters.
+    """
+    rng = random.Random(seed)
+    lines = ["1\t{n}\t1\t{n}\t{n}\t{n}\t100.00\t{r}\t{r}".format(
+        n=REF_LENGTH, r=REFERENCE)]
+    hits = []
+    tiles = REF_LENGTH // TILE
+    for query in range(1, queries + 1, 10):
+        if query % 20 == 1:
+            starts = [tile * TILE + 1 for tile in rng.sample(range(tiles), 40)]
+        else:
+            starts = [rng.randrange(tiles) * TILE + 1] * 40
+        hits.extend((query, start, TILE - 1000) for start in starts)
+    for _ in range(rows - 1 - len(hits)):
+        query = rng.randint(1, queries)
+        while query % 10 == 1:
+            query = rng.randint(1, queries)
+        length = rng.randint(100, 5000)
+        if rng.random() < 0.33:
+            start = rng.randint(1, 100) * 1000
+        else:
+            start = rng.randint(1, REF_LENGTH - length)
+        hits.append((query, start, length))
+
+    for query, start, length in hits:
+        qstart = rng.randint(1, 1000000)
+        lines.append("{s}\t{e}\t{qs}\t{qe}\t{l}\t{l}\t99.00\t{r}\t{q}".format(
+            s=start, e=start + length - 1, qs=qstart, qe=qstart + length - 1,
+            l=length, r=REFERENCE, q="{q:06d}F".format(q=query)))
+
+    return lines
+
+
+def rescan_homologs(lines, ref_length):
+    """The scoring of process_coords before the grouped index"""
+    coords = [tuple(i.split()) for i in lines]
+    count = Counter(i[8] for i in coords)
+
+    filtered = [i for i, c in count.items() if c > 3]
+
+    query_dict = {}
+    self = None
+    for query in filtered:
+        query_hits = []
+
+        for line in coords:
+            if line[7] == line[8]:
+                self = line[7]
+            elif line[8] == query:
+                query_hits.append(line)
+        query_dict[query] = query_hits
+        query_dict.pop(self, None)
+
+    new_list = []
+
+    for key, value in query_dict.items():
+        startends = []
+        total_bp = sum([int(i[4]) for i in value])
+        percent_ref = round(total_bp / float(ref_length), 4)
+
+        for hit in value:
+            startends.append((hit[0], hit[1]))
+
+        if len(sweep_merge(startends)) / float(len(startends)) > 0.75:
+            if percent_ref >= 0.03:
+                ratio = len(sweep_merge(startends)) / float(len(startends))
+                new_list.append((key, total_bp, percent_ref, ratio))
+
+    return sorted(new_list)
+
+
+def grouped_homologs(table, ref_length):
+    """homology.score_coords homologs in rescan_homologs' layout"""
+    scores = homology.score_coords(table, ref_length)
+
+    return sorted((table.names[row['query']], int(row['total_bp']),
+                   float(row['percent_ref']), float(row['ratio']))
+                  for row in scores[scores['homolog']])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="coords rows per table")
+    parser.add_argument("--queries", type=int, nargs='+', default=[100, 500],
+                        help="query contig counts to time")
+    args = parser.parse_args()
+
+    for queries in args.queries:
+        lines = synthetic_coords(args.rows, queries)
+
+        start = time.time()
+        old = rescan_homologs(lines, REF_LENGTH)
+        rescan = time.time() - start
+
+        start = time.time()
+        table = coordsutils.parse_coords(lines)
+        parsed = time.time() - start
+        new = grouped_homologs(table, REF_LENGTH)
+        scored = time.time() - start - parsed
+
+        if old != new:
+            sys.exit("{q} queries: homologs differ".format(q=queries))
+        print("{r} rows, {q} queries ({h} homologs): rescan {a:.2f}s -> "
+              "parse {p:.2f}s + score_coords {b:.3f}s".format(
+                  r=args.rows, q=queries, h=len(new), a=rescan, p=parsed,
+                  b=scored))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,16 +14,25 @@ log.setLevel(logging.INFO)
 def main():
     """Clean a fasta file"""
     args = get_parser()
-    fastafile = os.path.abspath(args.fastafile)
+    fastafile = args.fastafile
+    if fastafile != '-':
+        fastafile = os.path.abspath(fastafile)
     debug = args.debug
     logfile = args.log
 
+    # Keep log messages out of the cleaned fasta when writing to stdout,
+    # which is also the default output for stdin
+    output = args.output or ('-' if args.fastafile == '-' else None)
+    stream = sys.stderr if output == '-' else None
     if debug:
-        utils.setup_log(log, file_name=logfile, level=logging.DEBUG)
+        utils.setup_log(log, file_name=logfile, level=logging.DEBUG,
+                        stream=stream)
     else:
-        utils.setup_log(log, file_name=logfile, level=logging.INFO)
+        utils.setup_log(log, file_name=logfile, level=logging.INFO,
+                        stream=stream)
 
-    cleaned = utils.clean_fasta(fastafile, log)
+    cleaned = utils.clean_fasta(fastafile, log, output,
+                                nproc=args.nproc)
     log.info("Your cleaned fasta file can be found here: %s", cleaned)
 
     return
@@ -34,7 +43,14 @@ def get_parser():
 
     __version__ = 0.1
     parser = argparse.ArgumentParser(version=__version__)
-    parser.add_argument("fastafile", type=str, help='path to a Fasta File')
+    parser.add_argument("fastafile", type=str,
+                        help='path to a Fasta File (*.gz ok, - for stdin)')
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="cleaned fasta (*.gz to compress, - for "
+                             "stdout); default <name>_cleaned.fa")
+    parser.add_argument("--nproc", type=int, default=1,
+                        help="processes for an uncompressed input file "
+                             "(default: %(default)s)")
     parser.add_argument("--log", type=str, default=None)
     parser.add_argument('--debug', action='store_true',
                         help="Print debug logging to stdout")
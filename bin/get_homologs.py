@@ -8,13 +8,29 @@ Greg Concepcion gconcepcion@pacificbiosciences.com
 import os
 import csv
 import sys
+import hashlib
 import argparse
+import shutil
 import logging
+import tempfile
 import subprocess
-from collections import Counter
+import multiprocessing
+
+import numpy as np
 
-import pbcore.io.FastaIO as fi
 from falcon_tools import utils
+from falcon_tools import delta as deltautils
+from falcon_tools import coords as coordsutils
+from falcon_tools import homology
+from falcon_tools import sketch
+from falcon_tools import cache as cacheutils
+from falcon_tools.manifest import RunManifest
+from falcon_tools.fasta import FastaIndex
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -48,6 +64,69 @@ def _get_mummer_bins():
 
 NUCMER_BIN, SHOW_COORDS_BIN, DELTA_FILTER_BIN = _get_mummer_bins()
 
+# nucmer threads per job when --jobs is not given
+DEFAULT_JOB_THREADS = 4
+# target reference bp per nucmer invocation in --all-vs-all mode
+DEFAULT_BATCH_BP = 50000000
+# query suffix blocks in --symmetric mode; more blocks skip more pairs but
+# write more query fastas
+DEFAULT_QUERY_BLOCKS = 8
+# default size bound of the --cache-dir result cache, in GB
+DEFAULT_CACHE_GB = 50
+# per-reference stage checkpoints, used to resume interrupted runs
+MANIFEST = 'homologs.manifest.json'
+# prefix of the genome-wide homology matrix (.npz + .tsv)
+MATRIX = 'homologs'
+# every reference's score table, appended as it is scored and indexed by
+# the manifest's qfile stage records
+SCORES = 'homologs.scores'
+
+NUCMER_ARGS = ["--maxmatch", "-l", "100", "-c", "500"]
+
+_NUCMER_VERSION = []
+
+
+def _nucmer_version():
+    """Version string of NUCMER_BIN, part of every cache key"""
+    if not _NUCMER_VERSION:
+        version = ''.join(utils.iter_lines([NUCMER_BIN, "--version"],
+                                           os.getcwd(), log))
+        _NUCMER_VERSION.append("{b} {v}".format(b=NUCMER_BIN,
+                                                v=version.strip()))
+    return _NUCMER_VERSION[0]
+
+
+def nucmer_key(reference_digest, queries_digest):
+    """Cache key for aligning a reference against a query set"""
+    return cacheutils.cache_key(reference_digest, queries_digest,
+                                _nucmer_version(), *NUCMER_ARGS)
+
+
+def _delta_path(reference):
+    """Per-reference delta written (or split) into deltas/"""
+    refname = os.path.basename(reference.rstrip(".fasta"))
+    return "deltas/{r}.delta".format(r=refname)
+
+
+def _scores_digest(start, end):
+    """Checksum of the SCORES entry at [start, end), None if it is gone"""
+    if not os.path.exists(SCORES) or os.path.getsize(SCORES) < end:
+        return None
+    with open(SCORES, 'rb') as infile:
+        infile.seek(start)
+        return hashlib.sha1(infile.read(end - start)).hexdigest()
+
+
+def _make_dir(path):
+    """mkdir that succeeds if the directory exists, e.g. made by another
+    pool worker in the meantime"""
+    if not os.path.exists(path):
+        try:
+            os.mkdir(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
 
 def run_nucmer(reference, queries, threads):
     """run nucmer for each reference against all queries"""
@@ -55,100 +134,97 @@ def run_nucmer(reference, queries, threads):
 
     log.info("Searching all queries for alignments with reference %s", refname)
 
-    if not os.path.exists('deltas'):
-        os.mkdir('deltas')
-    prefix = "deltas/{f}".format(f=refname)
-    cmd = [NUCMER_BIN, "--maxmatch", "-l", "100", "-c", "500",
-           "-t", str(threads), "-p", prefix, reference, queries]
-    log.debug(cmd)
-    stdout, stderr = utils.run(cmd, os.getcwd(), log)
+    _make_dir('deltas')
+    prefix = "deltas/{f}.running".format(f=refname)
+    cmd = [NUCMER_BIN] + NUCMER_ARGS + [
+        "-t", str(threads), "-p", prefix, reference, queries]
+    partial = "{p}.delta".format(p=prefix)
+
+    # nucmer writes under a temporary name, renamed once it exits 0, so a
+    # failed or killed run never leaves a delta that looks finished
+    try:
+        with open(os.devnull, 'wb') as devnull:
+            with utils.stream_cmd(cmd, os.getcwd(), log, stdout=devnull):
+                pass
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    deltafile = _delta_path(reference)
+    os.rename(partial, deltafile)
 
-    if stderr:
-        log.debug(stderr)
-
-    deltafile = "{p}.delta".format(p=prefix)
     return deltafile
 
 
-def run_show_coords(deltafile):
-    """run show-coords for each reference"""
+def run_show_coords(deltafile, cache=None, key=None):
+    """run show-coords for each reference
+
+    Output is parsed line by line straight from the pipe into a compact
+    Coords table instead of being buffered as text.
+    """
+    if cache is not None and key is not None:
+        key = cacheutils.cache_key(key, SHOW_COORDS_BIN, "-HT")
+        if cache.has(key, '.coords.npz'):
+            log.debug("Reusing cached coords for %s", deltafile)
+            return coordsutils.load_coords(cache.path(key, '.coords.npz'))
+
     log.debug("Converting delta to coords")
 
     cmd = [SHOW_COORDS_BIN, "-HT", deltafile]
-    log.debug(cmd)
-    stdout, stderr = utils.run(cmd, os.getcwd(), log)
-    coords_file = [line for line in stdout.split(os.linesep)]
+    coords = coordsutils.parse_coords(utils.iter_lines(cmd, None, log))
 
-    if stderr:
-        log.debug(stderr)
+    if cache is not None and key is not None:
+        tmp = cache.tempfile()
+        with open(tmp, 'wb') as outfile:
+            coords.save(outfile)
+        cache.store(key, '.coords.npz', tmp, move=True)
 
-    return coords_file
+    return coords
 
 
-def run_delta_filter(deltafile):
+def run_delta_filter(deltafile, cache=None, key=None):
     """Generate filtered delta file for mummerplot"""
 
-    log.debug("filtering delta for plotting")
     new_delta = "{d}_filtered.delta".format(d=deltafile.rstrip('.delta'))
-    
-    cmd = [DELTA_FILTER_BIN, "-g", deltafile]
+    if cache is not None and key is not None:
+        key = cacheutils.cache_key(key, DELTA_FILTER_BIN, "-g")
+        if cache.fetch(key, '.filtered.delta', new_delta):
+            return new_delta
 
-    stdout, stderr = utils.run(cmd, os.getcwd(), log)
+    log.debug("filtering delta for plotting")
+    cmd = [DELTA_FILTER_BIN, "-g", deltafile]
 
-    if stderr:
-        log.debug(stderr)
+    utils.run_to_file(cmd, os.getcwd(), log, new_delta)
 
-    with open(new_delta, 'w') as output:
-        for line in stdout:
-            output.write(line)
+    if cache is not None and key is not None:
+        cache.store(key, '.filtered.delta', new_delta)
 
     return new_delta
 
 
-def process_coords(coordsfile, delta, length_dict):
-    """Process *.coords output for significant matches"""
+def process_coords(coords, reference, length_dict, scoring=None):
+    """Process show-coords alignments for significant matches
 
-    log.debug("Processing coords file")
-    reference = os.path.basename(delta.rstrip('.delta'))
-
-    coords = [tuple(i.split()) for i in coordsfile]
-    count = Counter(i[8] for i in coords)
-
-    filtered = [i for i, c in count.iteritems() if c > 3]
-
-    query_dict = {}
-    self = None
-    for query in filtered:
-        query_hits = []
-
-        for line in coords:
-            if line[7] == line[8]:
-                self = line[7]
-                #pass
-            elif line[8] == query:
-                query_hits.append(line)
-        query_dict[query] = query_hits
-        query_dict.pop(self, None)
-
-    new_list = []
-
-    for key, value in query_dict.iteritems():
-        startends = []
-        total_bp = sum([int(i[4]) for i in value])
-        percent_ref = round(total_bp / float(length_dict[reference]), 4)
+    scoring holds homology.score_coords threshold keywords. Every scored
+    query, homolog or not, is appended to SCORES for the homology matrix.
+    Returns the qfile and the (start, end) offsets of the SCORES entry.
+    """
 
-        for hit in value:
-            startends.append((hit[0], hit[1]))
+    log.debug("Processing coords file")
+    reference = os.path.basename(reference.rstrip(".fasta"))
 
-        if len(merge(startends)) / float(len(startends)) > 0.75:
-            if percent_ref >= 0.03:
-                ratio = len(merge(startends)) / float(len(startends))
-                new_list.append((key, total_bp, percent_ref, ratio))
+    table = homology.score_coords(coords, length_dict[reference],
+                                  **(scoring or {}))
+    scores = homology.append_scores(SCORES, table, coords.names)
+    new_list = [(coords.names[row['query']], int(row['total_bp']),
+                 float(row['percent_ref']), float(row['ratio']))
+                for row in table[table['homolog']]]
 
     log.info("%s shares homology with %s", reference, ",".join([i[0] for i in new_list]))
     qfile = write_qfile(reference, new_list, length_dict)
 
-    return qfile
+    return qfile, scores
 
 
 def write_qfile(reference, contigs, length_dict):
@@ -172,56 +248,574 @@ def write_qfile(reference, contigs, length_dict):
     return qfile
 
 
-def get_length_dict(fastas):
-    """Generate length dictionary for all contigs"""
+def write_plot_qfile(qfile, mirrored):
+    """Copy of a --symmetric qfile for mummerplot, without the homologs
+    whose alignments were mirrored from other references' deltas"""
+    derived = set(mirrored.names[idx]
+                  for idx in np.unique(mirrored.rows['query']).tolist())
+    plotdir = os.path.join(os.getcwd(), 'plot_qfiles')
+    _make_dir(plotdir)
+    plot_qfile = os.path.join(plotdir, os.path.basename(qfile))
+
+    with open(qfile, 'r') as infile:
+        with open(plot_qfile, 'w') as outfile:
+            for line in infile:
+                if line.split(' ', 1)[0] not in derived:
+                    outfile.write(line)
 
-    length_dict = {}
+    return plot_qfile
+
+
+def get_length_dict(index):
+    """Generate length dictionary for all contigs"""
 
-    for fasta in fastas:
-        fastadata = fi.FastaReader(fasta)
-        for record in fastadata:
-            length_dict[record.header] = len(record.sequence)
+    length_dict = index.lengths()
+    # References and qfile rows are looked up with the '|arrow' suffix
+    # stripped, the same way explode_fasta names its files
+    for name, length in list(length_dict.items()):
+        length_dict.setdefault(name.rstrip('|arrow'), length)
 
     return length_dict
 
 
 
-def merge(qhits):
-    """Merge overlapping hits together to get a contiguous interval"""
-
-    intervals = [(int(i[0]), int(i[1])) for i in qhits]
-
-    if not intervals:
-        return []
-    data = []
-    for interval in intervals:
-        data.append((interval[0], 0))
-        data.append((interval[1], 1))
-    data.sort()
-    merged = []
-    stack = [data[0]]
-    for i in xrange(1, len(data)):
-        datum = data[i]
-        if datum[1] == 0:
-            # this is a lower bound, push this onto the stack
-            stack.append(datum)
-        elif datum[1] == 1:
-            if stack:
-                start = stack.pop()
-            if len(stack) == 0:
-                # we have found our merged interval
-                merged.append((start[0], datum[0]))
-    return merged
-
-
-def get_mummerplot_cmd(delta, qfile):
-    """Generate mummerplot command for each reference"""
-    prefix = os.path.basename(delta).rstrip('.delta')
-    new_delta = run_delta_filter(delta)
-
-    cmd = "mummerplot -layout -Q {q} -postscript -p {p} {d}".format(q=qfile,
-                                                                    d=new_delta,
-                                                                    p=prefix)
+def split_cores(nproc, jobs=None):
+    """Split the total core budget into concurrent jobs x nucmer threads"""
+    nproc = max(1, nproc)
+    if jobs is None:
+        jobs = max(1, nproc // DEFAULT_JOB_THREADS)
+    jobs = max(1, min(jobs, nproc))
+    threads = max(1, nproc // jobs)
+
+    return jobs, threads
+
+
+class References(object):
+    """Per-contig nucmer references backed by the assembly index
+
+    Each reference is named by its exploded fasta path
+    (fastas/<contig>.fasta). Without explode, the record is only extracted
+    into a temporary fasta of that name while nucmer runs on it.
+    """
+
+    def __init__(self, index, explode=True):
+        self.index = index
+        self.explode = explode
+        self.contigs = dict(utils.reference_paths(index))
+        self.paths = sorted(self.contigs)
+
+    def contig(self, reference):
+        """Sequence ID of a reference"""
+        return self.contigs[reference]
+
+    def length(self, reference):
+        """Length of a reference in bp"""
+        return self.index[self.contigs[reference]].length
+
+    def digest(self, reference):
+        """Content checksum of a reference record"""
+        return self.index.digest(self.contigs[reference])
+
+    def write(self, fasta, references):
+        """Extract references from the assembly into a (temporary) fasta"""
+        outdir = os.path.dirname(fasta)
+        if outdir:
+            _make_dir(outdir)
+        with open(fasta, 'wb') as outfile:
+            for reference in references:
+                self.index.write_record(self.contigs[reference], outfile)
+
+
+# References of the running search, set in the parent and in pool workers
+_REFERENCES = [None]
+
+
+def _set_references(references):
+    """Pool initializer: make the reference set available to _nucmer_job"""
+    _REFERENCES[0] = references
+
+
+def make_batches(references, paths, batch_bp):
+    """Group references into multi-contig batches of ~batch_bp each
+
+    Returns a list of (batch fasta, member references). Batch fastas are
+    written by the nucmer job that uses them and removed afterwards; each
+    is named after its first member, which no earlier run has recorded.
+    """
+    groups = []
+    members = []
+    size = 0
+    for reference in paths:
+        members.append(reference)
+        size += references.length(reference)
+        if size >= batch_bp:
+            groups.append(members)
+            members = []
+            size = 0
+    if members:
+        groups.append(members)
+
+    batches = [("batch_{r}".format(r=os.path.basename(members[0])), members)
+               for members in groups]
+
+    log.debug("Grouped %d references into %d nucmer batches",
+              len(paths), len(batches))
+    return batches
+
+
+def query_blocks(references, nblocks):
+    """Split the references, in order, into nblocks runs of similar bp"""
+    total = sum(references.length(reference) for reference in references.paths)
+    blocks = []
+    members = []
+    size = 0
+    for reference in references.paths:
+        members.append(reference)
+        size += references.length(reference)
+        if size * nblocks >= total * (len(blocks) + 1):
+            blocks.append(members)
+            members = []
+    if members:
+        blocks.append(members)
+
+    return blocks
+
+
+def write_query_sets(references, queries, blocks, tmpdir):
+    """(query fasta, references) per block for --symmetric mode
+
+    The references of block k are aligned only against the contigs of
+    blocks k and later, written to <tmpdir>/suffix_<k>.fasta; block 0
+    uses the whole assembly. Alignments with earlier blocks are taken from the
+    earlier references' own results (see SymmetricPairs).
+    """
+    sets = []
+    for idx, members in enumerate(blocks):
+        if idx:
+            suffix = os.path.join(tmpdir,
+                                  "suffix_{i:03d}.fasta".format(i=idx))
+            references.write(suffix, [reference for block in blocks[idx:]
+                                      for reference in block])
+        else:
+            suffix = queries
+        sets.append((suffix, members))
+
+    log.info("Aligning %d query blocks against shrinking query suffixes",
+             len(blocks))
+    return sets
+
+
+def prefilter_queries(references, k, scale, min_containment, nproc=1,
+                      blocks=None, batch_bp=None):
+    """(candidate query references, references) sets from sketch containment"""
+    log.info("Sketching %d contigs (k=%d, scale=%d)", len(references.paths),
+             k, scale)
+    candidates = sketch.SketchIndex.from_index(
+        references.index, k, scale, nproc).candidates(min_containment)
+    path_of = dict((references.contig(reference), reference)
+                   for reference in references.paths)
+    if blocks is None:
+        blocks = [references.paths]
+
+    sets = []
+    alone = []
+    pairs = 0
+    for idx, members in enumerate(blocks):
+        allowed = set(reference for block in blocks[idx:]
+                      for reference in block)
+        group = []
+        queries = set()
+        size = 0
+        for reference in members:
+            found = set(path_of[name] for name in
+                        candidates[references.contig(reference)]
+                        if path_of.get(name) in allowed)
+            found.discard(reference)
+            if not found:
+                alone.append(reference)
+                continue
+            pairs += len(found)
+            group.append(reference)
+            queries.update(found)
+            queries.add(reference)
+            size += references.length(reference)
+            if not batch_bp or size >= batch_bp:
+                sets.append((_in_order(references, queries), group))
+                group = []
+                queries = set()
+                size = 0
+        if group:
+            sets.append((_in_order(references, queries), group))
+    if alone:
+        sets.append((None, alone))
+
+    log.info("Prefilter kept %d of %d reference/query pairs; %d references "
+             "have no candidates", pairs,
+             len(references.paths) * (len(references.paths) - 1), len(alone))
+    return sets
+
+
+def _in_order(references, paths):
+    """paths (a set of references) in assembly order"""
+    return [reference for reference in references.paths
+            if reference in paths]
+
+
+def write_empty_delta(reference):
+    """Delta without alignments, for a reference with nothing to align"""
+    delta = _delta_path(reference)
+    with open(delta, 'w') as outfile:
+        outfile.write("{r} {r}\nNUCMER\n".format(
+            r=os.path.abspath(reference)))
+
+    return delta
+
+
+class SymmetricPairs(object):
+    """Derive B -> A alignments from A -> B in --symmetric mode
+
+    A reference in block k was only aligned against blocks k and later, so
+    its hits with contigs of earlier blocks are the swapped alignments of
+    those contigs. Results are added as each reference's coords become
+    available; a reference is ready to score once every reference of the
+    earlier blocks has been added.
+    """
+
+    def __init__(self, references, blocks):
+        self.references = references
+        self.blocks = blocks
+        self.block = {}
+        self.contig_block = {}
+        for idx, members in enumerate(blocks):
+            for reference in members:
+                self.block[reference] = idx
+                self.contig_block[references.contig(reference)] = idx
+        self.remaining = [len(members) for members in blocks]
+        self.waiting = [[] for _ in blocks]
+        self.sources = [[] for _ in blocks]
+        self.complete = 0
+        self.mirrored = {}
+
+    def add(self, reference, coords, digest, item):
+        """Add a reference's coords; returns the items now ready to score
+
+        digest identifies the coords (the coords stage checksum) and item
+        is handed back once the reference is ready.
+        """
+        block = self.block[reference]
+        later = np.array([self.contig_block.get(name, -1) > block
+                          for name in coords.names], dtype=bool)
+        if len(coords):
+            swapped = coords.select(later[coords.rows['query']]).swapped()
+            for idx in np.unique(swapped.rows['ref']).tolist():
+                self.mirrored.setdefault(coords.names[idx], []).append(
+                    swapped.select(swapped.rows['ref'] == idx))
+        self.sources[block].append(digest)
+        self.remaining[block] -= 1
+
+        ready = []
+        if block <= self.complete:
+            ready.append(item)
+        else:
+            self.waiting[block].append(item)
+        while self.complete < len(self.blocks) and \
+                not self.remaining[self.complete]:
+            self.complete += 1
+            if self.complete < len(self.blocks):
+                ready.extend(self.waiting[self.complete])
+                self.waiting[self.complete] = []
+
+        return ready
+
+    def pop(self, reference):
+        """(derived Coords or None, key of their sources) of a reference"""
+        sources = [digest for block in self.sources[:self.block[reference]]
+                   for digest in block]
+        tables = self.mirrored.pop(self.references.contig(reference), None)
+        mirrored = coordsutils.concat_coords(tables) if tables else None
+
+        return mirrored, cacheutils.cache_key(*sorted(sources))
+
+
+def _nucmer_job(job):
+    """Pool worker: align a reference (or batch) against all queries
+
+    Returns a list of (reference, delta, cache key); the members of a
+    batch share its delta, and are split out of it only to be cached.
+    queries is a fasta, or a list of references to extract into a
+    temporary query fasta in tmpdir.
+    """
+    (reference, members, queries, threads, cache, keys, temporary,
+     tmpdir) = job
+    references = _REFERENCES[0]
+    query_fasta = queries
+    if isinstance(queries, list):
+        query_fasta = os.path.join(
+            tmpdir, "queries_{r}".format(r=os.path.basename(reference)))
+        references.write(query_fasta, queries)
+    fasta = reference
+    if temporary:
+        fasta = os.path.join(tmpdir, os.path.basename(reference))
+        references.write(fasta, members)
+    try:
+        delta = run_nucmer(fasta, query_fasta, threads)
+    finally:
+        if temporary:
+            os.remove(fasta)
+        if query_fasta is not queries:
+            os.remove(query_fasta)
+
+    if cache is not None and members == [reference]:
+        cache.store(keys[reference], '.delta', delta)
+    elif cache is not None:
+        outputs = dict((references.contig(member), (member, cache.tempfile()))
+                       for member in members)
+        deltautils.split_delta(delta, outputs, log)
+        for member, member_delta in outputs.values():
+            cache.store(keys[member], '.delta', member_delta, move=True)
+
+    return [(member, delta, keys.get(member)) for member in members]
+
+
+def _queries_digest(references, queries):
+    """Content key of a query fasta or of a list of query references"""
+    if queries is None:
+        return None
+    if isinstance(queries, list):
+        return cacheutils.cache_key(*[references.digest(query)
+                                      for query in queries])
+    return cacheutils.file_digest(queries)
+
+
+def search_references(references, queries, nproc, jobs=None, batch_bp=None,
+                      cache=None, done=None, query_sets=None, tmpdir=None):
+    """Run nucmer for all references, yielding (reference, delta, key)"""
+    if query_sets is None:
+        query_sets = [(queries, references.paths)]
+    query_of = {}
+    for idx, (_, members) in enumerate(query_sets):
+        for reference in members:
+            query_of[reference] = idx
+    deltas = dict(done or {})
+    keys = {}
+    cached = [reference for reference in references.paths
+              if reference in deltas]
+    paths = [reference for reference in references.paths
+             if reference not in deltas]
+    empty = [reference for reference in paths
+             if query_sets[query_of[reference]][0] is None]
+    if empty:
+        _make_dir('deltas')
+        for reference in empty:
+            write_empty_delta(reference)
+        cached.extend(empty)
+        empty = set(empty)
+        paths = [reference for reference in paths if reference not in empty]
+    if cache is not None:
+        digests = [_queries_digest(references, query_fasta)
+                   for query_fasta, _ in query_sets]
+        for reference in cached:
+            if digests[query_of[reference]] is not None:
+                keys[reference] = nucmer_key(references.digest(reference),
+                                             digests[query_of[reference]])
+        todo = []
+        _make_dir('deltas')
+        for reference in paths:
+            keys[reference] = nucmer_key(references.digest(reference),
+                                         digests[query_of[reference]])
+            if cache.fetch(keys[reference], '.delta', _delta_path(reference)):
+                cached.append(reference)
+            else:
+                todo.append(reference)
+        log.info("Reusing cached alignments for %d of %d references",
+                 len(paths) - len(todo), len(paths))
+        paths = todo
+
+    jobs, threads = split_cores(nproc, jobs)
+    log.info("Running %d concurrent nucmer job(s) with %d thread(s) each",
+             jobs, threads)
+    todo = set(paths)
+    tasks = []
+    for query_fasta, members in query_sets:
+        members = [reference for reference in members if reference in todo]
+        if not members:
+            continue
+        if batch_bp:
+            tasks.extend(
+                (batch, batch_members, query_fasta, threads, cache,
+                 dict((member, keys.get(member)) for member in batch_members),
+                 True, tmpdir)
+                for batch, batch_members in make_batches(
+                    references, members, batch_bp))
+        else:
+            tasks.extend((reference, [reference], query_fasta, threads, cache,
+                          {reference: keys.get(reference)},
+                          not references.explode, tmpdir)
+                         for reference in members)
+
+    log.info("Aligning %d references in %d nucmer run(s)", len(paths),
+             len(tasks))
+
+    # deltas/ is made here, before any pool worker needs it
+    _make_dir('deltas')
+
+    if jobs == 1:
+        _set_references(references)
+        for reference in cached:
+            yield (reference, deltas.get(reference, _delta_path(reference)),
+                   keys.get(reference))
+        for task in tasks:
+            for result in _nucmer_job(task):
+                yield result
+        return
+
+    # Start the pool before handing out cached results so nucmer runs
+    # while the caller post-processes them
+    pool = multiprocessing.Pool(jobs, _set_references, (references,))
+    try:
+        results = pool.imap_unordered(_nucmer_job, tasks)
+        for reference in cached:
+            yield (reference, deltas.get(reference, _delta_path(reference)),
+                   keys.get(reference))
+        for batch_results in results:
+            for result in batch_results:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# (batch delta, Coords) of the last batch read, shared by its members
+_BATCH_COORDS = [None, None]
+# filtered delta of every batch delta filtered so far
+_BATCH_FILTERED = {}
+
+
+def _member_coords(delta, contig, show_coords=False):
+    """Alignments of one member of a batch delta; the batch is read once"""
+    if _BATCH_COORDS[0] != delta:
+        if show_coords:
+            coords = run_show_coords(delta)
+        else:
+            coords = deltautils.read_coords(delta)
+        _BATCH_COORDS[:] = [delta, coords]
+    coords = _BATCH_COORDS[1]
+    ref = coords.names.index(contig) if contig in coords.names else -1
+
+    return coords.select(coords.rows['ref'] == ref)
+
+
+def reference_coords(reference, ref_digest, delta, key, manifest, cache=None,
+                     show_coords=False, contig=None):
+    """Run the coords stage of one reference with a recorded nucmer stage
+
+    Returns (nucmer record, coords record, Coords). Coords is None when
+    the coords stage was reused from a previous run. contig is set when
+    delta is a batch delta, and names the reference's rows in it.
+    """
+    nucmer = manifest.done(reference, 'nucmer', ref_digest)
+
+    coords = None
+    coords_stage = manifest.done(reference, 'coords', nucmer['sha1'])
+    if coords_stage is None:
+        if contig is not None:
+            coords = _member_coords(delta, contig, show_coords)
+        elif show_coords:
+            coords = run_show_coords(delta, cache, key)
+        else:
+            coords = deltautils.read_coords(delta)
+        coords_file = "{d}.coords.npz".format(
+            d=_delta_path(reference).rstrip('.delta'))
+        with open(coords_file, 'wb') as outfile:
+            coords.save(outfile)
+        coords_stage = manifest.record(reference, 'coords', coords_file,
+                                       nucmer['sha1'])
+
+    return nucmer, coords_stage, coords
+
+
+def finish_reference(reference, ref_digest, delta, key, length_dict, manifest,
+                     cache=None, lazy=False, show_coords=False,
+                     scoring=None, mirrored=None, mirror_key=None,
+                     contig=None):
+    """Run the checkpointed post-nucmer stages of one reference"""
+    nucmer, coords_stage, coords = reference_coords(
+        reference, ref_digest, delta, key, manifest, cache, show_coords,
+        contig)
+
+    scored = [coords_stage['sha1'], sorted((scoring or {}).items())]
+    if mirror_key is not None:
+        scored.append(mirror_key)
+    scored = cacheutils.cache_key(*scored)
+    qfile_stage = manifest.done(reference, 'qfile', scored)
+    if qfile_stage is not None:
+        span = qfile_stage.get('scores')
+        if span is None or _scores_digest(span[0], span[1]) != span[2]:
+            qfile_stage = None
+    if qfile_stage is None:
+        if coords is None:
+            coords = coordsutils.load_coords(coords_stage['output'])
+        if mirrored is not None:
+            coords = coordsutils.concat_coords([coords, mirrored])
+        qfile, (start, end) = process_coords(coords, reference, length_dict,
+                                             scoring)
+        qfile_stage = manifest.record(
+            reference, 'qfile', qfile, scored,
+            scores=[start, end, _scores_digest(start, end)])
+    scores = qfile_stage['scores'][0]
+
+    # Mirrored homologs have no alignments in this reference's delta
+    plot_qfile = qfile_stage['output']
+    if mirrored is not None:
+        plot_qfile = write_plot_qfile(plot_qfile, mirrored)
+
+    if lazy and not os.path.getsize(plot_qfile):
+        log.debug("No homologs to plot for %s, skipping delta-filter",
+                  reference)
+        return None, scores
+
+    filtered = manifest.done(reference, 'filtered', nucmer['sha1'])
+    if filtered is None or filtered.get('qfile') != plot_qfile:
+        plot_cmd = get_mummerplot_cmd(reference, delta, plot_qfile, cache,
+                                      key, contig)
+        filtered = manifest.record(
+            reference, 'filtered',
+            "{d}_filtered.delta".format(d=delta.rstrip('.delta')),
+            nucmer['sha1'], qfile=plot_qfile, plot=plot_cmd)
+
+    return filtered['plot'], scores
+
+
+def write_matrix(starts, prefix):
+    """Merge the SCORES entries at starts into one HomologyMatrix"""
+    matrix = homology.HomologyMatrix.from_scores(
+        homology.iter_scores(SCORES, starts))
+    matrix.save(prefix)
+    log.info("Wrote %d scored pairs (%d homologous) to %s.npz and %s.tsv",
+             len(matrix), int(matrix.rows['homolog'].sum()), prefix, prefix)
+
+    return matrix
+
+
+def get_mummerplot_cmd(reference, delta, qfile, cache=None, key=None,
+                       contig=None):
+    """Generate mummerplot command for each reference
+
+    A batch delta is filtered once, and each member's plot picks its
+    reference out of it with -r contig.
+    """
+    prefix = os.path.basename(_delta_path(reference)).rstrip('.delta')
+    if contig is None:
+        new_delta = run_delta_filter(delta, cache, key)
+        refopt = ""
+    else:
+        if delta not in _BATCH_FILTERED:
+            _BATCH_FILTERED[delta] = run_delta_filter(delta)
+        new_delta = _BATCH_FILTERED[delta]
+        refopt = "-r {r} ".format(r=quote(contig))
+
+    cmd = "mummerplot -layout {r}-Q {q} -postscript -p {p} {d}".format(
+        r=refopt, q=qfile, d=new_delta, p=prefix)
     return cmd
 
 
@@ -254,7 +848,71 @@ def get_parser():
     __version__ = 0.1
     parser = argparse.ArgumentParser(version=__version__)
     parser.add_argument("infile", type=str)
-    parser.add_argument("--nproc", type=int, default=8)
+    parser.add_argument("--nproc", type=int, default=8,
+                        help="Total number of cores to use")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of concurrent nucmer jobs; --nproc is "
+                             "split evenly between them (default: "
+                             "nproc / {t})".format(t=DEFAULT_JOB_THREADS))
+    parser.add_argument("--all-vs-all", action='store_true',
+                        help="Align the assembly against itself in a few "
+                             "multi-contig batches instead of one nucmer "
+                             "run per contig")
+    parser.add_argument("--batch-bp", type=int, default=DEFAULT_BATCH_BP,
+                        help="Reference bp per batch in --all-vs-all mode")
+    parser.add_argument("--symmetric", action='store_true',
+                        help="Align each reference only against itself and "
+                             "the contigs after it, taking the reverse "
+                             "direction of every pair from the earlier "
+                             "alignment; plots only show the aligned half")
+    parser.add_argument("--query-blocks", type=int,
+                        default=DEFAULT_QUERY_BLOCKS,
+                        help="Number of query suffix blocks in --symmetric "
+                             "mode (default: %(default)s)")
+    parser.add_argument("--prefilter", action='store_true',
+                        help="Align each reference only against the contigs "
+                             "whose k-mer sketches share enough of it, "
+                             "extracted into a small query fasta")
+    parser.add_argument("--sketch-k", type=int, default=sketch.DEFAULT_K,
+                        help="--prefilter k-mer size, at most 32 "
+                             "(default: %(default)s)")
+    parser.add_argument("--sketch-scale", type=int,
+                        default=sketch.DEFAULT_SCALE,
+                        help="--prefilter keeps about one k-mer in this "
+                             "many (default: %(default)s)")
+    parser.add_argument("--min-containment", type=float, default=None,
+                        help="--prefilter shared k-mer fraction of the "
+                             "smaller contig needed to align a pair "
+                             "(default: half of --min-percent)")
+    parser.add_argument("--no-explode", action='store_true',
+                        help="Do not split the assembly into fastas/; "
+                             "extract each nucmer reference from the indexed "
+                             "assembly only while it is being aligned")
+    parser.add_argument("--min-hits", type=int, default=homology.MIN_HITS,
+                        help="a homolog needs more than this many "
+                             "alignments (default: %(default)s)")
+    parser.add_argument("--min-ratio", type=float, default=homology.MIN_RATIO,
+                        help="merged/total alignment ratio a homolog must "
+                             "exceed (default: %(default)s)")
+    parser.add_argument("--min-percent", type=float,
+                        default=homology.MIN_PERCENT,
+                        help="minimum fraction of the reference a homolog's "
+                             "alignments must cover (default: %(default)s)")
+    parser.add_argument("--show-coords", action='store_true',
+                        help="Convert deltas with show-coords instead of "
+                             "parsing them directly")
+    parser.add_argument("--lazy-plots", action='store_true',
+                        help="Only run delta-filter and write plot commands "
+                             "for references that have homologs")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Reuse nucmer, show-coords and delta-filter "
+                             "results across runs from this directory")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_GB,
+                        help="Evict least recently used cache entries above "
+                             "this many GB")
+    parser.add_argument("--restart", action='store_true',
+                        help="Ignore {m} and recompute every stage".format(
+                            m=MANIFEST))
     parser.add_argument("--log", type=str, default=None)
 
     parser.add_argument('--debug', action='store_true',
@@ -278,29 +936,127 @@ def main():
         utils.setup_log(log, file_name=logfile, level=logging.INFO)
 
     if infile.endswith(('.fasta', '.fa')):
-        fastas = utils.explode_fasta(infile, log)
+        index = FastaIndex.open(infile, log)
+        if not args.no_explode:
+            utils.explode_fasta(infile, log, index)
+        references = References(index, explode=not args.no_explode)
     else:
         log.info("Please provide FASTA as your input file")
 
-    length_dict = get_length_dict(fastas)
-    total_seqs = len(length_dict.keys())
-    length_sum = sum(length_dict.values())
+    length_dict = get_length_dict(index)
+    total_seqs = len(index)
+    length_sum = sum(entry.length for entry in index)
     log.info("Beginning homology search in %s", infile)
     log.info("Total Contigs: %d", total_seqs)
     log.info("Total Bp: %d", length_sum)
 
+    batch_bp = args.batch_bp if args.all_vs_all else None
+    cache = None
+    if args.cache_dir:
+        cache = cacheutils.ResultCache(
+            args.cache_dir, int(args.cache_size * 1024 ** 3), log)
+
+    scoring = {'min_hits': args.min_hits, 'min_ratio': args.min_ratio,
+               'min_percent': args.min_percent}
+    params = {'queries': cacheutils.file_digest(infile),
+              'nucmer': NUCMER_ARGS}
+    query_sets = None
+    pairs = None
+    blocks = None
+    if args.symmetric:
+        blocks = query_blocks(references, max(1, args.query_blocks))
+        pairs = SymmetricPairs(references, blocks)
+        params['symmetric'] = len(blocks)
     plot_out = 'plots.sh'
-
-    with open(plot_out, 'w') as plot_out:
-        for fasta in sorted(fastas):
-
-            delta = run_nucmer(fasta, infile, threads)
-            coordsfile = run_show_coords(delta)
-
-            qfile = process_coords(coordsfile, delta, length_dict)
-            plot_cmd = get_mummerplot_cmd(delta, qfile)
-
-            plot_out.write(plot_cmd + '\n')
+    order = dict((fasta, idx) for idx, fasta in enumerate(references.paths))
+
+    # Jobs finish out of order; buffer plot commands so plots.sh is always
+    # written in sorted reference order
+    pending = {}
+    next_idx = 0
+    scores = {}
+
+    tmpdir = None
+    if args.prefilter or blocks is not None or batch_bp or args.no_explode:
+        # Temporary query, batch and reference fastas go into a directory
+        # of this run only
+        tmpdir = tempfile.mkdtemp(prefix='homologs.', dir=os.getcwd())
+    try:
+        if args.prefilter:
+            min_containment = args.min_containment
+            if min_containment is None:
+                min_containment = args.min_percent / 2
+            query_sets = prefilter_queries(references, args.sketch_k,
+                                           args.sketch_scale, min_containment,
+                                           threads, blocks, batch_bp)
+            params['prefilter'] = [args.sketch_k, args.sketch_scale,
+                                   min_containment]
+        elif blocks is not None:
+            query_sets = write_query_sets(references, infile, blocks,
+                                          tmpdir)
+
+        manifest = RunManifest(MANIFEST, params, log, args.restart)
+        if not manifest.stages and os.path.exists(SCORES):
+            # Only the manifest indexes SCORES; start it over with it
+            os.remove(SCORES)
+        done = {}
+        for fasta in references.paths:
+            nucmer = manifest.done(fasta, 'nucmer', references.digest(fasta))
+            if nucmer is not None:
+                done[fasta] = nucmer['output']
+        if done:
+            log.info("Skipping nucmer for %d references completed in a "
+                     "previous run", len(done))
+
+        with open(plot_out, 'w') as plot_out:
+            for fasta, delta, key in search_references(
+                    references, infile, threads, args.jobs, batch_bp, cache,
+                    done, query_sets, tmpdir):
+                # Deltas are only yielded once nucmer exited 0 (or from the
+                # cache), so this is where the nucmer stage is recorded
+                if manifest.done(fasta, 'nucmer',
+                                 references.digest(fasta)) is None:
+                    manifest.record(fasta, 'nucmer', delta,
+                                    references.digest(fasta))
+                # Members of a batch share its delta
+                contig = None
+                if delta != _delta_path(fasta):
+                    contig = references.contig(fasta)
+                if pairs is None:
+                    ready = [(fasta, delta, key, contig)]
+                else:
+                    _, coords_stage, coords = reference_coords(
+                        fasta, references.digest(fasta), delta, key,
+                        manifest, cache, args.show_coords, contig)
+                    if coords is None:
+                        coords = coordsutils.load_coords(
+                            coords_stage['output'])
+                    ready = pairs.add(fasta, coords, coords_stage['sha1'],
+                                      (fasta, delta, key, contig))
+
+                for fasta, delta, key, contig in ready:
+                    mirrored, mirror_key = None, None
+                    if pairs is not None:
+                        mirrored, mirror_key = pairs.pop(fasta)
+                    plot_cmd, scores[order[fasta]] = finish_reference(
+                        fasta, references.digest(fasta), delta, key,
+                        length_dict, manifest, cache, args.lazy_plots,
+                        args.show_coords, scoring, mirrored, mirror_key,
+                        contig)
+                    pending[order[fasta]] = plot_cmd
+
+                while next_idx in pending:
+                    plot_cmd = pending.pop(next_idx)
+                    if plot_cmd is not None:
+                        plot_out.write(plot_cmd + '\n')
+                    next_idx += 1
+                    plot_out.flush()
+
+        manifest.close()
+        write_matrix([scores[idx] for idx in sorted(scores)], MATRIX)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,23 @@
 #!/usr/bin/env python
 """
-Check raw read, pread and overlap distributions in a completed FALCON job_root
+Check raw read, pread and overlap distributions in completed FALCON job_roots
 Author: Greg Concepcion gconcepcion@pacificbiosciences.com
 """
 
 import os
+import re
 import sys
 import logging
 import argparse
+import tempfile
+from multiprocessing.pool import ThreadPool
 
-import pandas
+import numpy as np
 import matplotlib
 from falcon_tools import utils
+from falcon_tools import dazzdb
+from falcon_tools import cache as cacheutils
+from falcon_tools.histogram import Distribution
 matplotlib.use('agg')
 from matplotlib import pyplot as plt
 matplotlib.style.use('ggplot')
@@ -19,152 +25,370 @@ matplotlib.style.use('ggplot')
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+LENGTH_BIN_WIDTH = 500
+OVLP_BIN_WIDTH = 1
+# overlap counts 0..OVLP_MAX get their own bin, larger ones share one
+OVLP_MAX = 100
+_READ_COUNT = re.compile(br'\n\+ R (\d+)')
+_LENGTH_LINE = re.compile(br'\nL \d+ (\d+ \d+)')
+# fc_ovlp_stats: read id, read length, 5' and 3' overlap counts
+_OVLP_LINE = re.compile(br'\n\S+[ \t]+\d+[ \t]+(\d+[ \t]+\d+)')
+# default size bound of the extracted-data cache, in GB
+DEFAULT_CACHE_GB = 10
 
-def get_overlaps(jobdir, nproc):
-    """Get overlap distributions"""
-    log.info("Gathering overlap stats")
 
-    lasfofn = os.path.join(jobdir, '1-preads_ovl/merge-gather/las.fofn')
-    if not os.path.exists(lasfofn):
-        log.debug("No las.fofn!")
+def add_histograms(first, second):
+    """Sum two bincount arrays of possibly different lengths"""
+    if len(first) < len(second):
+        first, second = second, first
+    total = first.copy()
+    total[:len(second)] += second
 
-    cmd = ['fc_ovlp_stats', '--n_core', str(nproc), '--fofn', lasfofn]
+    return total
 
-    cwd = os.path.join(jobdir, '2-asm-falcon')
-    stdout, stderr = utils.run(cmd, cwd, log)
-    if stderr:
-        log.debug(stderr)
 
-    return stdout.splitlines()
+def overlap_histograms(stream):
+    """Bincounts of 5' and 3' overlap counts from fc_ovlp_stats output"""
+    five = np.zeros(0, dtype=np.int64)
+    three = np.zeros(0, dtype=np.int64)
+    for block in utils.iter_blocks(stream):
+        pairs = _OVLP_LINE.findall(block)
+        if not pairs:
+            continue
+        counts = np.fromstring(b' '.join(pairs), dtype=np.int64, sep=' ')
+        five = add_histograms(five, np.bincount(counts[0::2]))
+        three = add_histograms(three, np.bincount(counts[1::2]))
+
+    return five, three
+
+
+def db_sources(dbpath):
+    """Files a DB's read lengths are extracted from"""
+    idx = dazzdb.index_path(dbpath)
+    return [dbpath, idx] if os.path.exists(idx) else [dbpath]
+
+
+def lengths_key(dbpath):
+    """Cache key of a DB's read lengths"""
+    return cacheutils.cache_key('lengths', cacheutils.stat_key(
+        *db_sources(dbpath)))
+
 
+def overlaps_key(lasfile):
+    """Cache key of a LAS file's overlap histograms"""
+    return cacheutils.cache_key('fc_ovlp_stats',
+                                cacheutils.stat_key(lasfile))
 
-def plot_ovlp_stats(jobdir, nproc):
+
+def read_las_fofn(jobdir):
+    """LAS files listed in las.fofn (paths relative to 2-asm-falcon)"""
+    lasfofn = os.path.join(jobdir, '1-preads_ovl/merge-gather/las.fofn')
+    if not os.path.exists(lasfofn):
+        log.debug("No las.fofn!")
+        return []
+
+    cwd = os.path.join(jobdir, '2-asm-falcon')
+    with open(lasfofn, 'r') as infile:
+        return [os.path.join(cwd, line.strip())
+                for line in infile if line.strip()]
+
+
+def _ovlp_stats_shard(job):
+    """ThreadPool worker: overlap histograms of a single LAS file"""
+    lasfile, cwd, cache = job
+    key = None
+    if cache is not None and os.path.exists(lasfile):
+        key = overlaps_key(lasfile)
+        if cache.has(key, '.ovlp.npz'):
+            data = np.load(cache.path(key, '.ovlp.npz'))
+            try:
+                return data['five'], data['three']
+            finally:
+                data.close()
+
+    handle, fofn = tempfile.mkstemp(suffix='.fofn')
+    with os.fdopen(handle, 'w') as outfile:
+        outfile.write(lasfile + '\n')
+    cmd = ['fc_ovlp_stats', '--n_core', '1', '--fofn', fofn]
+    try:
+        with utils.stream_cmd(cmd, cwd, log) as stdout:
+            five, three = overlap_histograms(stdout)
+    finally:
+        os.remove(fofn)
+
+    if key is not None:
+        tmp = cache.tempfile()
+        with open(tmp, 'wb') as outfile:
+            np.savez(outfile, five=five, three=three)
+        cache.store(key, '.ovlp.npz', tmp, move=True)
+
+    return five, three
+
+
+def overlap_distributions(shards, outdir):
+    """Sum per-LAS overlap histograms, then bin and save the 5' and 3'
+    overlap count distributions (counts above OVLP_MAX in one last bin)"""
+    five = np.zeros(0, dtype=np.int64)
+    three = np.zeros(0, dtype=np.int64)
+    for shard_five, shard_three in shards:
+        five = add_histograms(five, shard_five)
+        three = add_histograms(three, shard_three)
+
+    nbins = OVLP_MAX // OVLP_BIN_WIDTH + 2
+    five = Distribution.from_bincount('5prime_overlaps', five,
+                                      OVLP_BIN_WIDTH, nbins)
+    three = Distribution.from_bincount('3prime_overlaps', three,
+                                       OVLP_BIN_WIDTH, nbins)
+    for dist in (five, three):
+        dist.save(os.path.join(outdir, dist.name))
+
+    return five, three
+
+
+def plot_ovlp_stats(five, three, outdir):
     """Plot 5' and 3' Overlap distributions"""
 
     log.info("Generating overlap plots")
-    overlaps = get_overlaps(jobdir, nproc)
-    ovlp_dict = {}
-    for ovlp in overlaps:
-        rid, length, fiveprime, threeprime = ovlp.split()
-        ovlp_dict[rid] = fiveprime, threeprime
+    fig, axs = plt.subplots(2, 1, figsize=(5, 10))
+    for ax, dist, title in ((axs[0], five, '5\' overlaps'),
+                            (axs[1], three, '3\' overlaps')):
+        draw_distribution(ax, dist)
+        ax.set_title(title)
+        ax.set_xlim(0, (OVLP_MAX + 2) * OVLP_BIN_WIDTH)
 
-    fiveprime_ovlps = [int(v[0]) for k, v in ovlp_dict.items()]
-    threeprime_ovlps = [int(v[1]) for k, v in ovlp_dict.items()]
-    fig, axs = plt.subplots(2, 1)
+    outfig = os.path.join(outdir, 'overlap_distribution.png')
+    fig.savefig(outfig)
+    plt.close(fig)
 
-    dataframe = pandas.DataFrame({'five_prime_ovlps': fiveprime_ovlps,
-                                  'three_prime_ovlps': threeprime_ovlps})
 
-    binsfive = dataframe['five_prime_ovlps'].max() + 1
-    binsthree = dataframe['three_prime_ovlps'].max() + 1
+def parse_lengths(block):
+    """Read lengths of the `L well start end` lines in a DBdump block"""
+    pairs = _LENGTH_LINE.findall(block)
+    if not pairs:
+        return np.empty(0, dtype=np.int32)
+    coords = np.fromstring(b' '.join(pairs), dtype=np.int64, sep=' ')
 
-    dataframe['five_prime_ovlps'].plot.hist(
-        bins=binsfive, ax=axs[0], figsize=(5, 10))
-    axs[0].set_title('5\' overlaps')
-    axs[0].set_xlim(0, 100)
+    return (coords[1::2] - coords[0::2]).astype(np.int32)
 
-    dataframe['three_prime_ovlps'].plot.hist(
-        bins=binsthree, ax=axs[1], figsize=(5, 10))
-    axs[1].set_title('3\' overlaps')
-    axs[1].set_xlim(0, 100)
 
-    outfig = os.path.join('outfigs', 'overlap_distribution.png')
-    plt.savefig(outfig)
-    return dataframe
+def read_lengths(stream, blocksize=utils.BLOCK_SIZE):
+    """Stream `DBdump -h` output into an int32 array of read lengths
 
+    The dump is parsed a block at a time, so memory stays at ~4 bytes per
+    read rather than the size of the text. The array is sized from the
+    `+ R` read count when DBdump reports it and grown by doubling if not.
+    """
+    lengths = None
+    count = 0
+    for block in utils.iter_blocks(stream, blocksize):
+        if lengths is None:
+            total = _READ_COUNT.search(block)
+            lengths = np.empty(int(total.group(1)) if total else 1 << 20,
+                               dtype=np.int32)
+        chunk = parse_lengths(block)
+        if count + len(chunk) > len(lengths):
+            grown = np.empty(max(2 * len(lengths), count + len(chunk)),
+                             dtype=np.int32)
+            grown[:count] = lengths[:count]
+            lengths = grown
+        lengths[count:count + len(chunk)] = chunk
+        count += len(chunk)
+
+    if lengths is None:
+        return np.zeros(0, dtype=np.int32)
+    lengths.resize(count, refcheck=False)
 
-def get_length_distribution(dbpath):
-    "Get sequence lengths from the DB"
+    return lengths
 
-    log.info("Getting lengths from %s ", dbpath)
+
+def extract_lengths(dbpath):
+    """Read lengths from the DB index, or from DBdump if unrecognised"""
+    length_list = dazzdb.read_lengths(dbpath, log)
+    if length_list is not None:
+        return length_list
+
+    log.info("Falling back to DBdump for %s", dbpath)
     cmd = ['DBdump', '-h', dbpath]
     cwd = os.path.dirname(os.path.dirname(dbpath))
-    stdout, stderr = utils.run(cmd, cwd, log)
-    length_list = []
-    if stderr:
-        log.debug(stderr)
 
-    for line in stdout.splitlines():
-        if line.startswith('L '):
-            _, _, start, end = line.split()
-            seqlen = int(end) - int(start)
-            length_list.append(seqlen)
+    with utils.stream_cmd(cmd, cwd, log) as stdout:
+        return read_lengths(stdout)
+
+
+def get_length_distribution(dbpath, cache=None):
+    "Get sequence lengths from the DB"
 
+    log.info("Getting lengths from %s ", dbpath)
+    key = None
+    if cache is not None:
+        key = lengths_key(dbpath)
+        if cache.has(key, '.npy'):
+            log.info("Reusing cached lengths for %s", dbpath)
+            return np.load(cache.path(key, '.npy'), mmap_mode='r')
+
+    length_list = extract_lengths(dbpath)
     log.info("Entries in DB: %d", len(length_list))
+
+    if key is not None:
+        tmp = cache.tempfile()
+        with open(tmp, 'wb') as outfile:
+            np.save(outfile, np.asarray(length_list))
+        cache.store(key, '.npy', tmp, move=True)
+
     return length_list
 
 
-def plot_length_distribution_raw(path):
-    "Plot Raw Read length distribution"
+def length_distribution(dbpath, context, outdir, cache=None):
+    """Bin a DB's read lengths and save the bins"""
+    lengths = get_length_distribution(dbpath, cache)
+    dist = Distribution.from_values(context, lengths, LENGTH_BIN_WIDTH)
+    dist.save(os.path.join(outdir, "{c}_lengths".format(c=context)))
+    log.info("%s: N=%d mean=%d max=%d N50=%d", context, dist.summary['n'],
+             dist.summary['mean'], dist.summary['max'], dist.summary['n50'])
+
+    return dist
+
+
+def raw_length_distribution(path, outdir, cache=None):
+    "Raw Read length distribution"
 
     rawdb = os.path.join(path, '0-rawreads', 'raw_reads.db')
-    lengths = None
+    dist = None
     if os.path.exists(rawdb):
-        lengths = get_length_distribution(rawdb)
-        plot_length_distribution(lengths, context='Raw_read')
+        dist = length_distribution(rawdb, 'Raw_read', outdir, cache)
     else:
         log.info("Raw read DB not found, skipping...")
-    return lengths
+    return dist
 
 
-def plot_length_distribution_preads(path):
-    "Plot Pread length distribution"
+def pread_length_distribution(path, outdir, cache=None):
+    "Pread length distribution"
 
     preaddb = os.path.join(path, '1-preads_ovl', 'preads.db')
-    lengths = None
+    dist = None
     if os.path.exists(preaddb):
-
-        lengths = get_length_distribution(preaddb)
-        plot_length_distribution(lengths, context='Pread')
-
+        dist = length_distribution(preaddb, 'Pread', outdir, cache)
     else:
         log.info("Pread DB not found, skipping...")
 
-    return lengths
+    return dist
+
 
+def draw_distribution(ax, dist, **kwargs):
+    """Draw a binned Distribution as a histogram on ax"""
+    ax.bar(dist.edges[:-1], dist.counts, width=dist.width, align='edge',
+           **kwargs)
 
-def plot_length_distribution(lengths, context='None'):
+
+def plot_length_distribution(dist, outdir, context='None'):
     "Plot length distribution"
     title = "{t} Length Distribution".format(t=context)
 
-    length_df1 = pandas.DataFrame({'lengths': lengths})
-    ax = length_df1.plot.hist(bins=100, alpha=0.5, legend=False)
+    fig, ax = plt.subplots()
+    draw_distribution(ax, dist, alpha=0.5)
     _, ymax = tuple(ax.get_ylim())
     _, xmax = tuple(ax.get_xlim())
-    mean = int(length_df1['lengths'].mean())
-    plt.xlabel('Read length', fontsize=16)
-    plt.ylabel('Count', fontsize=16)
-    plt.title(title, fontsize=18)
-    maxlen = "Max: {d} Bp".format(d=xmax)
-    meanlen = "Mean: {d} Bp".format(d=mean)
+    ax.set_xlabel('Read length', fontsize=16)
+    ax.set_ylabel('Count', fontsize=16)
+    ax.set_title(title, fontsize=18)
+    maxlen = "Max: {d} Bp".format(d=dist.summary['max'])
+    meanlen = "Mean: {d} Bp".format(d=int(dist.summary['mean']))
+    n50len = "N50: {d} Bp".format(d=dist.summary['n50'])
 
-    plt.text(xmax / 2, ymax / 1.5, maxlen, fontsize=14)
-    plt.text(xmax / 2, ymax / 2, meanlen, fontsize=14)
+    ax.text(xmax / 2, ymax / 1.5, maxlen, fontsize=14)
+    ax.text(xmax / 2, ymax / 2, meanlen, fontsize=14)
+    ax.text(xmax / 2, ymax / 3, n50len, fontsize=14)
 
-    outfig = os.path.join('outfigs', "{c}_out.png".format(c=context))
-    plt.savefig(outfig)
+    outfig = os.path.join(outdir, "{c}_out.png".format(c=context))
+    fig.savefig(outfig)
+    plt.close(fig)
 
 
-def plot_dual_lengths(rlens, plens):
+def plot_dual_lengths(raw, pread, outdir):
     "Generate dual length distribution"
     title = "Read Length Distributions"
-    length_df1 = pandas.DataFrame({'raw': rlens})
-    length_df2 = pandas.DataFrame({'pread': plens})
-
-    ax1 = length_df1.hist(bins=100, alpha=0.5)
-    for ax, (colname, values) in zip(ax1.flat, length_df2.iteritems()):
-        values.plot.hist(ax=ax, bins=100, alpha=0.5)
-    plt.xlim(0, 60000)
-    plt.legend(['Pread', 'Raw'])
-    plt.title(title)
-    outfig = os.path.join('outfigs', 'length_distributions.png')
+
+    fig, ax = plt.subplots()
+    draw_distribution(ax, raw, alpha=0.5, label='Raw')
+    draw_distribution(ax, pread, alpha=0.5, label='Pread')
+    ax.set_xlim(0, 60000)
+    ax.legend()
+    ax.set_title(title)
+    outfig = os.path.join(outdir, 'length_distributions.png')
     log.info("Saving figure:\n")
     log.info(outfig)
-    plt.savefig(outfig)
-
-
-def validate_falcon_root(dirpath):
-    """ Validate which distributions we can create """
+    fig.savefig(outfig)
+    plt.close(fig)
+
+
+def plot_comparison(dists, title, outfig):
+    """Overlay one distribution per job as outlines"""
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for label, dist in dists:
+        ax.step(dist.edges[:-1], dist.counts, where='post', label=label)
+    ax.set_xlabel('Read length', fontsize=16)
+    ax.set_ylabel('Count', fontsize=16)
+    ax.set_title(title, fontsize=18)
+    ax.legend(fontsize=8)
+    fig.savefig(outfig)
+    plt.close(fig)
+
+
+def write_summary(jobs, outfile):
+    """Write one TSV row of summary statistics per job and distribution"""
+    fields = ['n', 'total', 'mean', 'max', 'n50']
+    with open(outfile, 'w') as out:
+        out.write("\t".join(['job', 'distribution'] + fields) + "\n")
+        for label, results in jobs:
+            dists = [results[stage] for stage in ('raw', 'pread')
+                     if results.get(stage)]
+            dists.extend(results.get('overlaps') or [])
+            for dist in dists:
+                row = [label, dist.name] + [
+                    "{v:.1f}".format(v=dist.summary[field])
+                    if field == 'mean' else str(dist.summary[field])
+                    for field in fields]
+                out.write("\t".join(row) + "\n")
+
+
+def write_report(jobs, outdir):
+    """Combined comparison of several job roots: summary table and
+    overlaid length distributions"""
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    write_summary(jobs, os.path.join(outdir, 'summary.tsv'))
+    for stage, context in (('raw', 'Raw_read'), ('pread', 'Pread')):
+        dists = [(label, results[stage]) for label, results in jobs
+                 if results.get(stage)]
+        if dists:
+            plot_comparison(
+                dists, "{c} Length Distributions".format(c=context),
+                os.path.join(outdir, "{c}_comparison.png".format(c=context)))
+
+    log.info("Combined report: %s", outdir)
+
+
+def _cache_status(cache, keys, suffix):
+    """Log suffix saying how many of keys are cached"""
+    if cache is None:
+        return ""
+    cached = sum(1 for key in keys
+                 if os.path.exists(cache.path(key, suffix)))
+    if cached == len(keys):
+        return " (cached)"
+    if len(keys) == 1:
+        return " (stale, will be extracted)"
+    return " ({c} of {n} cached, rest will be extracted)".format(
+        c=cached, n=len(keys))
+
+
+def validate_falcon_root(dirpath, cache=None):
+    """ Validate which distributions we can create
+
+    With a cache, also report which sources are cached and which are new
+    or changed since they were last extracted.
+    """
     raw_reads_db = os.path.join(dirpath, '0-rawreads/raw_reads.db')
     preads_db = os.path.join(dirpath, '1-preads_ovl/preads.db')
     overlaps = os.path.join(dirpath, '2-asm-falcon/preads.ovl')
@@ -174,18 +398,23 @@ def validate_falcon_root(dirpath):
 
     if os.path.exists(raw_reads_db):
         raw = True
-        log.info("raw_reads.db exists")
+        log.info("raw_reads.db exists%s", _cache_status(
+            cache, [lengths_key(raw_reads_db)], '.npy'))
     else:
         log.info("No raw_reads.db found, skipping raw_read distribution!")
 
     if os.path.exists(preads_db):
         pread = True
-        log.info("preads.db exists")
+        log.info("preads.db exists%s", _cache_status(
+            cache, [lengths_key(preads_db)], '.npy'))
     else:
         log.info("No preads.db found, skipping pread distribution!")
 
     if os.path.exists(overlaps):
-        log.info("preads.ovl exists")
+        lasfiles = [las for las in read_las_fofn(dirpath)
+                    if os.path.exists(las)]
+        log.info("preads.ovl exists%s", _cache_status(
+            cache, [overlaps_key(las) for las in lasfiles], '.ovlp.npz'))
         overlap = True
     else:
         log.info("No preads.ovl found, skipping overlap distribution!")
@@ -193,10 +422,95 @@ def validate_falcon_root(dirpath):
     return raw, pread, overlap
 
 
+def submit_job(pool, jobdir, outdir, cache=None):
+    """Queue a job root's extraction work on a shared pool
+
+    Extraction reads independent files with independent tools, so the raw
+    and pread DBs and every LAS file become separate tasks. Returns
+    {stage: [AsyncResult]}, with one result per LAS file for overlaps.
+    """
+    log.info("Validating FALCON_ROOT %s...", jobdir)
+    raw, pread, overlaps = validate_falcon_root(jobdir, cache)
+
+    stages = {}
+    if raw:
+        stages['raw'] = [pool.apply_async(raw_length_distribution,
+                                          (jobdir, outdir, cache))]
+    if pread:
+        stages['pread'] = [pool.apply_async(pread_length_distribution,
+                                            (jobdir, outdir, cache))]
+    if overlaps:
+        cwd = os.path.join(jobdir, '2-asm-falcon')
+        lasfiles = read_las_fofn(jobdir)
+        log.info("Collecting overlap stats for %d LAS files", len(lasfiles))
+        stages['overlaps'] = [pool.apply_async(_ovlp_stats_shard,
+                                               ((las, cwd, cache),))
+                              for las in lasfiles]
+    if not stages:
+        log.info("No data found, are you sure %s is a FALCON job_root?",
+                 jobdir)
+
+    return stages
+
+
+def collect_job(jobdir, outdir, stages):
+    """Wait for a job's stages; returns {stage: result}
+
+    A stage that raised is logged and left out without affecting the
+    others.
+    """
+    results = {}
+    for stage in sorted(stages):
+        try:
+            values = [pending.get() for pending in stages[stage]]
+            if stage == 'overlaps':
+                results[stage] = overlap_distributions(values, outdir)
+            else:
+                results[stage] = values[0]
+        except Exception:
+            log.exception("%s: %s extraction failed", jobdir, stage)
+
+    return results
+
+
+def plot_job(results, outdir):
+    """Draw a job's figures from its extracted distributions"""
+    if results.get('raw'):
+        plot_length_distribution(results['raw'], outdir, context='Raw_read')
+
+    if results.get('pread'):
+        plot_length_distribution(results['pread'], outdir, context='Pread')
+
+    if results.get('raw') and results.get('pread'):
+        plot_dual_lengths(results['raw'], results['pread'], outdir)
+
+    if results.get('overlaps'):
+        plot_ovlp_stats(results['overlaps'][0], results['overlaps'][1],
+                        outdir)
+
+
+def job_labels(jobdirs):
+    """Short report labels: directory names, or full paths if ambiguous"""
+    names = [os.path.basename(jobdir.rstrip(os.sep)) for jobdir in jobdirs]
+    if len(set(names)) < len(names):
+        return list(jobdirs)
+    return names
+
+
+def read_job_fofn(fofn):
+    """Job roots listed one per line; blank lines and # comments skipped"""
+    with open(fofn, 'r') as infile:
+        return [line.strip() for line in infile
+                if line.strip() and not line.startswith('#')]
+
+
 def main():
     """Generate Read length Distribution and Overlap stat distribution"""
     args = get_parser()
-    jobdir = os.path.abspath(args.jobdir)
+    jobdirs = list(args.jobdir)
+    if args.fofn:
+        jobdirs.extend(read_job_fofn(args.fofn))
+    jobdirs = [os.path.abspath(jobdir) for jobdir in jobdirs or ['./']]
     nproc = args.nproc
     debug = args.debug
     logfile = args.log
@@ -206,31 +520,36 @@ def main():
     else:
         utils.setup_log(log, file_name=logfile, level=logging.INFO)
 
-    outdir = os.path.join(jobdir, 'outfigs')
-
-    if not os.path.exists(outdir):
-        os.mkdir(outdir)
-
-    log.info("Validating FALCON_ROOT %s...", jobdir)
-
-    raw, pread, overlaps = validate_falcon_root(jobdir)
-
-    if raw:
-        raw_lengths = plot_length_distribution_raw(jobdir)
-
-    if pread:
-        pread_lengths = plot_length_distribution_preads(jobdir)
-
-    if raw and pread:
-        plot_dual_lengths(raw_lengths, pread_lengths)
-
-    if overlaps:
-        plot_ovlp_stats(jobdir, nproc)
-
-    if not raw and not pread and not overlaps:
-        log.info("No data found, are you sure %s is a FALCON job_root?", jobdir)
-
-    log.info("Finished! Find your plots here: %s", outdir)
+    # Every extraction task of every job shares one --nproc sized pool;
+    # matplotlib stays on the main thread
+    pool = ThreadPool(max(1, nproc))
+    try:
+        submitted = []
+        for jobdir in jobdirs:
+            outdir = os.path.join(jobdir, 'outfigs')
+            if not os.path.exists(outdir):
+                os.mkdir(outdir)
+            cache = None
+            if not args.no_cache:
+                cache = cacheutils.ResultCache(
+                    args.cache_dir or os.path.join(outdir, 'cache'),
+                    int(args.cache_size * 1024 ** 3), log)
+            submitted.append((jobdir, outdir,
+                              submit_job(pool, jobdir, outdir, cache)))
+
+        jobs = []
+        for label, (jobdir, outdir, stages) in zip(job_labels(jobdirs),
+                                                   submitted):
+            results = collect_job(jobdir, outdir, stages)
+            plot_job(results, outdir)
+            jobs.append((label, results))
+            log.info("Finished! Find your plots here: %s", outdir)
+    finally:
+        pool.close()
+        pool.join()
+
+    if len(jobs) > 1:
+        write_report(jobs, os.path.abspath(args.report_dir))
 
     return
 
@@ -240,9 +559,26 @@ def get_parser():
 
     __version__ = 0.1
     parser = argparse.ArgumentParser(version=__version__)
-    parser.add_argument("jobdir", type=str, nargs="?", default='./',
-                        help='path to a complete FALCON job directory')
-    parser.add_argument("--nproc", type=int, default=4)
+    parser.add_argument("jobdir", type=str, nargs="*", default=[],
+                        help='path(s) to complete FALCON job directories '
+                             '(default: ./)')
+    parser.add_argument("--fofn", type=str, default=None,
+                        help="file listing more job directories, one per "
+                             "line")
+    parser.add_argument("--report-dir", type=str, default='falcon_qc_report',
+                        help="combined comparison report when several jobs "
+                             "are given (default: %(default)s)")
+    parser.add_argument("--nproc", type=int, default=4,
+                        help="extraction tasks run at once, shared by all "
+                             "jobs (default: %(default)s)")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Keep extracted lengths and overlap counts "
+                             "here (default: <jobdir>/outfigs/cache)")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_GB,
+                        help="Evict least recently used cache entries above "
+                             "this many GB")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Always re-extract from the DBs and LAS files")
     parser.add_argument("--log", type=str, default=None)
     parser.add_argument('--debug', action='store_true',
                         help="Print debug logging to stdout")
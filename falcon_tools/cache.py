@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent content-addressed result cache"""
+import os
+import shutil
+import logging
+import hashlib
+import tempfile
+
+_DIGESTS = {}
+
+
+def file_digest(path, blocksize=1 << 20):
+    """sha1 of a file's contents, memoized per (path, size, mtime)"""
+    stat = os.stat(path)
+    memo = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    digest = _DIGESTS.get(memo)
+    if digest is None:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(blocksize), b''):
+                sha.update(block)
+        digest = _DIGESTS[memo] = sha.hexdigest()
+
+    return digest
+
+
+def cache_key(*parts):
+    """Combine digests, versions and parameters into a single cache key"""
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(str(part).encode('utf-8'))
+        sha.update(b'\0')
+
+    return sha.hexdigest()
+
+
+def stat_key(*paths):
+    """Cache key from the path, size and mtime of source files
+
+    Cheaper than file_digest for large inputs that are only ever replaced,
+    never edited in place with the same size and mtime.
+    """
+    parts = []
+    for path in paths:
+        stat = os.stat(path)
+        parts.extend([os.path.abspath(path), stat.st_size,
+                      repr(stat.st_mtime)])
+
+    return cache_key(*parts)
+
+
+class ResultCache(object):
+    """Directory of result files addressed by key + suffix
+
+    Entries are evicted least-recently-used first once the directory grows
+    past max_bytes; a cache hit refreshes the entry's mtime. Stores are
+    atomic, so several processes can share one cache directory.
+    """
+
+    def __init__(self, cachedir, max_bytes, log):
+        self.cachedir = os.path.abspath(cachedir)
+        self.max_bytes = max_bytes
+        self.log = log
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir)
+        self._size = None
+
+    def __getstate__(self):
+        # Loggers do not pickle on python 2; ship the logger name to workers
+        state = dict(self.__dict__)
+        state['log'] = self.log.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.log = logging.getLogger(state['log'])
+
+    def path(self, key, suffix):
+        """Location of a cache entry"""
+        return os.path.join(self.cachedir, key[:2], key + suffix)
+
+    def has(self, key, suffix):
+        """True if the entry exists; refreshes its LRU timestamp"""
+        entry = self.path(key, suffix)
+        try:
+            os.utime(entry, None)
+        except OSError:
+            return False
+        return True
+
+    def fetch(self, key, suffix, dest):
+        """Copy a cached entry to dest; returns False on a cache miss"""
+        if not self.has(key, suffix):
+            return False
+        self.log.debug("Cache hit %s%s -> %s", key, suffix, dest)
+        shutil.copyfile(self.path(key, suffix), dest)
+
+        return True
+
+    def tempfile(self):
+        """A scratch path on the cache filesystem for store(move=True)"""
+        handle, path = tempfile.mkstemp(dir=self.cachedir, suffix='.tmp')
+        os.close(handle)
+
+        return path
+
+    def store(self, key, suffix, src, move=False):
+        """Add src to the cache under key + suffix"""
+        entry = self.path(key, suffix)
+        if not os.path.exists(os.path.dirname(entry)):
+            try:
+                os.makedirs(os.path.dirname(entry))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(entry)):
+                    raise
+
+        if move:
+            tmp = src
+        else:
+            tmp = self.tempfile()
+            shutil.copyfile(src, tmp)
+        os.rename(tmp, entry)
+        self.log.debug("Cached %s as %s%s", src, key, suffix)
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += os.path.getsize(entry)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """(path, size, mtime) of every cache entry"""
+        for root, _, files in os.walk(self.cachedir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_bytes"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.log.debug("Evicted %s from cache", path)
+        self._size = total
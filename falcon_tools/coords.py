@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""Compact columnar storage for MUMmer show-coords alignments"""
+import numpy as np
+
+# One row per alignment, mirroring `show-coords -HT` columns. Reference and
+# query tags are stored as indexes into Coords.names.
+COORDS_DTYPE = np.dtype([('rstart', np.int32), ('rend', np.int32),
+                         ('qstart', np.int32), ('qend', np.int32),
+                         ('rlen', np.int32), ('qlen', np.int32),
+                         ('idy', np.float32),
+                         ('ref', np.int32), ('query', np.int32)])
+
+CHUNK_ROWS = 65536
+
+
+class Coords(object):
+    """Alignment table: a COORDS_DTYPE array plus its sequence name table"""
+
+    def __init__(self, rows, names):
+        self.rows = rows
+        self.names = names
+
+    def __len__(self):
+        return len(self.rows)
+
+    def by_query(self):
+        """Group non-self alignments by query
+
+        Returns (rows, query indexes, offsets) where rows are sorted by
+        query and rows[offsets[i]:offsets[i + 1]] are the hits of query i.
+        """
+        rows = self.rows
+        self_hits = rows['ref'] == rows['query']
+        if self_hits.any():
+            rows = rows[~self_hits]
+        # Deltas list each query's alignments together, so rows are often
+        # grouped already; skip the sort (and the copy) when they are
+        query = rows['query']
+        if len(query) and (query[1:] < query[:-1]).any():
+            rows = rows[np.argsort(query, kind='mergesort')]
+            query = rows['query']
+
+        heads = np.flatnonzero(np.append(True, query[1:] != query[:-1])) \
+            if len(query) else np.zeros(0, dtype=np.int64)
+        offsets = np.append(heads, len(rows))
+
+        return rows, query[heads], offsets
+
+    def select(self, mask):
+        """Coords of the rows selected by a boolean mask (or index array)"""
+        return Coords(self.rows[mask], self.names)
+
+    def swapped(self):
+        """The same alignments with reference and query exchanged
+
+        Rows keep the show-coords layout: reference coordinates ascend and
+        a reverse-strand hit has qstart > qend.
+        """
+        rows = self.rows
+        forward = rows['qstart'] <= rows['qend']
+        out = np.empty(len(rows), dtype=COORDS_DTYPE)
+        out['rstart'] = np.where(forward, rows['qstart'], rows['qend'])
+        out['rend'] = np.where(forward, rows['qend'], rows['qstart'])
+        out['qstart'] = np.where(forward, rows['rstart'], rows['rend'])
+        out['qend'] = np.where(forward, rows['rend'], rows['rstart'])
+        out['rlen'] = rows['qlen']
+        out['qlen'] = rows['rlen']
+        out['idy'] = rows['idy']
+        out['ref'] = rows['query']
+        out['query'] = rows['ref']
+
+        return Coords(out, self.names)
+
+    def save(self, fileobj):
+        """Write the table as .npz to a path or open binary file"""
+        np.savez(fileobj, rows=self.rows,
+                 names=np.array(self.names, dtype=np.str_))
+
+
+def load_coords(fileobj):
+    """Read a table written by Coords.save"""
+    data = np.load(fileobj)
+    try:
+        return Coords(data['rows'], data['names'].tolist())
+    finally:
+        data.close()
+
+
+def concat_coords(tables):
+    """Stack Coords tables, merging their name tables"""
+    builder = CoordsBuilder()
+    chunks = []
+    for table in tables:
+        remap = np.array([builder.name_index(name) for name in table.names],
+                         dtype=np.int32)
+        rows = table.rows.copy()
+        if len(remap):
+            rows['ref'] = remap[rows['ref']]
+            rows['query'] = remap[rows['query']]
+        chunks.append(rows)
+    if chunks:
+        rows = np.concatenate(chunks)
+    else:
+        rows = np.empty(0, dtype=COORDS_DTYPE)
+
+    return Coords(rows, builder.names)
+
+
+class CoordsBuilder(object):
+    """Accumulate alignments into fixed-size typed chunks"""
+
+    def __init__(self, chunk_rows=CHUNK_ROWS):
+        self.chunk_rows = chunk_rows
+        self.names = []
+        self._index = {}
+        self._chunks = []
+        self._pending = []
+
+    def name_index(self, name):
+        """Return the name table index of a sequence ID"""
+        idx = self._index.get(name)
+        if idx is None:
+            idx = self._index[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    def add(self, rstart, rend, qstart, qend, rlen, qlen, idy, ref, query):
+        """Append one alignment; ref/query are sequence IDs"""
+        self._pending.append((rstart, rend, qstart, qend, rlen, qlen, idy,
+                              self.name_index(ref), self.name_index(query)))
+        if len(self._pending) >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._chunks.append(np.array(self._pending, dtype=COORDS_DTYPE))
+            self._pending = []
+
+    def build(self):
+        """Return the accumulated Coords"""
+        self._flush()
+        if self._chunks:
+            rows = np.concatenate(self._chunks)
+        else:
+            rows = np.empty(0, dtype=COORDS_DTYPE)
+        self._chunks = []
+
+        return Coords(rows, self.names)
+
+
+def parse_coords(lines, chunk_rows=CHUNK_ROWS):
+    """Parse `show-coords -HT` lines (any iterable) into Coords"""
+    builder = CoordsBuilder(chunk_rows)
+    for line in lines:
+        row = line.split()
+        if not row:
+            continue
+        builder.add(int(row[0]), int(row[1]), int(row[2]), int(row[3]),
+                    int(row[4]), int(row[5]), float(row[6]), row[7], row[8])
+
+    return builder.build()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""Direct reader for DAZZ_DB read length tables"""
+import os
+
+import numpy as np
+
+# DAZZ_READ as written to `.<db>.idx` by fasta2DB/DBsplit (64-bit build)
+DAZZ_READ_DTYPE = np.dtype([('origin', '<i4'), ('rlen', '<i4'),
+                            ('fpulse', '<i4'), ('pad0', '<i4'),
+                            ('boff', '<i8'), ('coff', '<i8'),
+                            ('flags', '<i4'), ('pad1', '<i4')])
+# Leading DAZZ_DB fields: ureads, treads, cutoff, allarr
+DAZZ_HEADER_DTYPE = np.dtype([('ureads', '<i4'), ('treads', '<i4'),
+                              ('cutoff', '<i4'), ('allarr', '<i4')])
+# The DAZZ_DB struct is a few pointers and counters; anything far outside
+# this range is not an index we understand
+HEADER_BYTES = (DAZZ_HEADER_DTYPE.itemsize, 1024)
+
+DB_ALL = 0x1
+DB_BEST = 0x0800
+
+
+def index_path(dbpath):
+    """`path/name.db` -> `path/.name.idx`"""
+    root = os.path.splitext(os.path.basename(dbpath))[0]
+    return os.path.join(os.path.dirname(dbpath), '.{r}.idx'.format(r=root))
+
+
+def read_lengths(dbpath, log):
+    """Read lengths of the trimmed DB, as DBdump -h reports them
+
+    The read records of the .idx are memory-mapped and the rlen column is
+    taken as a strided view, so untrimmed DBs are read without a copy.
+    Returns None when the index is missing or its layout is not
+    recognised, so callers can fall back to DBdump.
+    """
+    idx = index_path(dbpath)
+    if not os.path.exists(idx):
+        log.debug("No DAZZ_DB index %s", idx)
+        return None
+
+    size = os.path.getsize(idx)
+    if size < HEADER_BYTES[0]:
+        log.debug("Truncated DAZZ_DB index %s", idx)
+        return None
+    header = np.fromfile(idx, dtype=DAZZ_HEADER_DTYPE, count=1)[0]
+    ureads, treads = int(header['ureads']), int(header['treads'])
+    offset = size - ureads * DAZZ_READ_DTYPE.itemsize
+    if ureads < 0 or not 0 <= treads <= ureads or \
+            not HEADER_BYTES[0] <= offset <= HEADER_BYTES[1]:
+        log.debug("Unrecognised DAZZ_DB index layout in %s", idx)
+        return None
+    if not ureads:
+        return np.empty(0, dtype=np.int32)
+
+    reads = np.memmap(idx, dtype=DAZZ_READ_DTYPE, mode='r', offset=offset,
+                      shape=(ureads,))
+    lengths = reads['rlen']
+    if (lengths < 0).any():
+        log.debug("Negative read lengths in %s", idx)
+        return None
+
+    # Same read selection as Trim_DB
+    cutoff = int(header['cutoff'])
+    allflag = 0 if int(header['allarr']) & DB_ALL else DB_BEST
+    if cutoff > 0 or allflag:
+        keep = (reads['flags'] & DB_BEST) >= allflag
+        if cutoff > 0:
+            keep &= lengths >= cutoff
+        lengths = lengths[keep]
+    if treads and len(lengths) != treads:
+        log.debug("%s: %d trimmed reads, header says %d", idx,
+                  len(lengths), treads)
+        return None
+
+    log.debug("Read %d lengths from %s", len(lengths), idx)
+    return lengths
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers for MUMmer *.delta alignment files"""
+import os
+import re
+
+import numpy as np
+
+from falcon_tools import utils
+from falcon_tools.coords import COORDS_DTYPE, Coords, CoordsBuilder
+from falcon_tools.fasta import as_str
+
+# `>ref query reflen querylen` and `S1 E1 S2 E2 errors simerrors stops`
+_HEADER = re.compile(br'\n>(\S+) (\S+) \d+ \d+')
+_ALIGNMENT = re.compile(br'\n\d+ \d+ \d+ \d+ \d+ \d+ \d+(?=\n)')
+_NEWLINE = ord('\n')
+_MINUS = ord('-')
+
+
+def split_delta(deltafile, outputs, log):
+    """Split a multi-reference delta into one delta per reference
+
+    outputs maps reference sequence ID -> (reference fasta, output delta).
+    Every output gets a copy of the delta header with the reference path
+    pointing at its own fasta, so references without alignments still get
+    a valid (empty) delta.
+    """
+    log.debug("Splitting %s into %d deltas", deltafile, len(outputs))
+    handles = {}
+
+    try:
+        with open(deltafile, 'r') as infile:
+            paths = infile.readline()
+            program = infile.readline()
+            queries = paths.rstrip('\n').split(' ', 1)[-1]
+
+            for ref_id, (fasta, outdelta) in outputs.items():
+                out = open(outdelta, 'w')
+                out.write('{r} {q}\n'.format(r=os.path.abspath(fasta),
+                                             q=queries))
+                out.write(program)
+                handles[ref_id] = out
+
+            out = None
+            for line in infile:
+                if line.startswith('>'):
+                    ref_id = line[1:].split(None, 1)[0]
+                    out = handles.get(ref_id)
+                    if out is None:
+                        log.debug("Alignments for unknown reference %s "
+                                  "in %s", ref_id, deltafile)
+                if out is not None:
+                    out.write(line)
+    finally:
+        for out in handles.values():
+            out.close()
+
+    return dict((ref_id, outdelta)
+                for ref_id, (_, outdelta) in outputs.items())
+
+
+def read_coords(deltafile, blocksize=utils.BLOCK_SIZE):
+    """Parse a delta file straight into Coords, like `show-coords -HT`
+
+    The file is scanned in blocks; alignment headers are matched with one
+    regex per block and the indel lines in between are only counted (via
+    a byte scan) to get each alignment's length for the identity, so no
+    per-line Python work is done for the indels. % identity is
+    (alignment length - errors) / alignment length, where the alignment
+    length is the reference span plus the gaps in the reference
+    (negative indel entries), rounded to two places as show-coords
+    prints it.
+    """
+    builder = CoordsBuilder()
+    chunks = []
+    tags = None
+    negatives = []
+
+    with open(deltafile, 'rb') as infile:
+        for block in utils.iter_blocks(infile, blocksize):
+            heads = np.array([(match.start(),
+                               builder.name_index(match.group(1)),
+                               builder.name_index(match.group(2)))
+                              for match in _HEADER.finditer(block)],
+                             dtype=np.int64).reshape(-1, 3)
+            starts = []
+            texts = []
+            for match in _ALIGNMENT.finditer(block):
+                starts.append(match.start())
+                texts.append(match.group(0))
+            starts = np.array(starts, dtype=np.int64)
+
+            # Gaps in the reference: indel lines starting with '-'. Those
+            # before the block's first alignment belong to the last one
+            # of the previous block
+            raw = np.frombuffer(block, dtype=np.uint8)
+            gaps = np.flatnonzero((raw[:-1] == _NEWLINE) &
+                                  (raw[1:] == _MINUS))
+            owner = np.searchsorted(starts, gaps, side='right') - 1
+            if negatives:
+                negatives[-1][-1] += int((owner < 0).sum())
+
+            if texts:
+                fields = np.fromstring(b' '.join(texts), dtype=np.int64,
+                                       sep=' ').reshape(-1, 7)
+                # Alignments before the block's first header continue the
+                # last header of the previous block
+                if tags is not None:
+                    heads = np.vstack([[[-1, tags[0], tags[1]]], heads])
+                which = np.searchsorted(heads[:, 0], starts, side='right') - 1
+                chunks.append((fields, heads[which, 1], heads[which, 2]))
+                negatives.append(np.bincount(owner[owner >= 0],
+                                             minlength=len(starts)))
+            if len(heads):
+                tags = heads[-1, 1:]
+
+    if not chunks:
+        return Coords(np.empty(0, dtype=COORDS_DTYPE),
+                      [as_str(name) for name in builder.names])
+
+    fields = np.concatenate([chunk[0] for chunk in chunks])
+    rows = np.empty(len(fields), dtype=COORDS_DTYPE)
+    rows['rstart'] = fields[:, 0]
+    rows['rend'] = fields[:, 1]
+    rows['qstart'] = fields[:, 2]
+    rows['qend'] = fields[:, 3]
+    rows['rlen'] = np.abs(fields[:, 1] - fields[:, 0]) + 1
+    rows['qlen'] = np.abs(fields[:, 3] - fields[:, 2]) + 1
+    length = rows['rlen'] + np.concatenate(negatives)
+    rows['idy'] = np.round((length - fields[:, 4]) * 100.0 / length, 2)
+    rows['ref'] = np.concatenate([chunk[1] for chunk in chunks])
+    rows['query'] = np.concatenate([chunk[2] for chunk in chunks])
+
+    return Coords(rows, [as_str(name) for name in builder.names])
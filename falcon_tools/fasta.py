@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""faidx-style FASTA index with mmap'd sequence access"""
+import os
+import mmap
+import hashlib
+
+_WHITESPACE = b' \t\r\n'
+
+
+def as_str(name):
+    """bytes -> native str"""
+    if isinstance(name, str):
+        return name
+    return name.decode('latin-1')
+
+
+class FastaEntry(object):
+    """One indexed record; fields follow the samtools .fai columns
+
+    linebases/linewidth are 0 when the record's line layout is irregular
+    (blank or ragged lines); such records are still readable but are not
+    representable in a .fai file.
+    """
+    __slots__ = ('name', 'length', 'offset', 'linebases', 'linewidth',
+                 'end', 'digest')
+
+    def __init__(self, name, length, offset, linebases, linewidth, end=None):
+        self.name = name
+        self.length = length
+        self.offset = offset
+        self.linebases = linebases
+        self.linewidth = linewidth
+        self.end = end
+        self.digest = None
+
+
+class FastaIndex(object):
+    """Sequence names, lengths and byte offsets of a FASTA file
+
+    Built in a single pass over the file, or loaded from an up to date
+    `<fasta>.fai`. Sequences are sliced out of an mmap of the FASTA rather
+    than parsed into per-line strings.
+    """
+
+    def __init__(self, fasta, entries):
+        self.fasta = fasta
+        self.entries = entries
+        self._by_name = dict((entry.name, entry) for entry in entries)
+        self._handle = None
+        self._mmap = None
+
+    @classmethod
+    def open(cls, fasta, log):
+        """Load <fasta>.fai if it is current, else build and save one"""
+        fai = fasta + '.fai'
+        if os.path.exists(fai) and \
+                os.path.getmtime(fai) >= os.path.getmtime(fasta):
+            log.debug("Loading index %s", fai)
+            return cls.load(fasta, fai)
+
+        log.info("Indexing %s", fasta)
+        index = cls.build(fasta)
+        if index.regular:
+            try:
+                index.save(fai)
+            except (IOError, OSError) as err:
+                log.debug("Could not write %s: %s", fai, err)
+
+        return index
+
+    @classmethod
+    def build(cls, fasta):
+        """Index a FASTA in one sequential pass"""
+        entries = []
+        entry = None
+        lines = []
+        pos = 0
+
+        def close(end):
+            entry.end = end
+            entry.length = sum(bases for bases, _ in lines)
+            if lines and all(line == lines[0] for line in lines[:-1]) and \
+                    lines[-1][0] <= lines[0][0] and lines[-1][0] > 0:
+                entry.linebases, entry.linewidth = lines[0]
+            entries.append(entry)
+
+        with open(fasta, 'rb') as infile:
+            for line in infile:
+                if line.startswith(b'>'):
+                    if entry is not None:
+                        close(pos)
+                    name = line[1:].split(None, 1)
+                    entry = FastaEntry(as_str(name[0] if name else b''),
+                                       0, pos + len(line), 0, 0)
+                    lines = []
+                elif entry is not None:
+                    lines.append((len(line.rstrip(_WHITESPACE)), len(line)))
+                pos += len(line)
+        if entry is not None:
+            close(pos)
+
+        return cls(fasta, entries)
+
+    @classmethod
+    def load(cls, fasta, fai):
+        """Read a samtools-compatible .fai"""
+        entries = []
+        with open(fai, 'r') as infile:
+            for line in infile:
+                name, length, offset, linebases, linewidth = \
+                    line.rstrip('\n').split('\t')[:5]
+                entries.append(FastaEntry(name, int(length), int(offset),
+                                          int(linebases), int(linewidth)))
+
+        return cls(fasta, entries)
+
+    def save(self, fai):
+        """Write a samtools-compatible .fai"""
+        with open(fai, 'w') as outfile:
+            for entry in self.entries:
+                outfile.write("{n}\t{l}\t{o}\t{b}\t{w}\n".format(
+                    n=entry.name, l=entry.length, o=entry.offset,
+                    b=entry.linebases, w=entry.linewidth))
+
+    @property
+    def regular(self):
+        """True if every record has a fixed line width (.fai compatible)"""
+        return all(entry.linebases or not entry.length
+                   for entry in self.entries)
+
+    def __getstate__(self):
+        # Pool workers reopen their own mmap
+        state = dict(self.__dict__)
+        state['_handle'] = state['_mmap'] = None
+        return state
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def lengths(self):
+        """{sequence name: length}"""
+        return dict((entry.name, entry.length) for entry in self.entries)
+
+    @property
+    def mm(self):
+        """Read-only mmap of the FASTA, opened on first use"""
+        if self._mmap is None:
+            self._handle = open(self.fasta, 'rb')
+            self._mmap = mmap.mmap(self._handle.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _entry(self, entry):
+        if isinstance(entry, FastaEntry):
+            return entry
+        return self._by_name[entry]
+
+    def _end(self, entry):
+        """Byte offset just past a record's sequence lines"""
+        if entry.end is None:
+            mm = self.mm
+            if entry.linebases:
+                nlines = -(-entry.length // entry.linebases)
+                end = entry.offset + entry.length + \
+                    nlines * (entry.linewidth - entry.linebases)
+                end = min(end, len(mm))
+            else:
+                end = mm.find(b'\n>', entry.offset - 1)
+                end = len(mm) if end < 0 else end + 1
+            entry.end = end
+        return entry.end
+
+    def header(self, entry):
+        """Full header line of a record, without '>' or line ending"""
+        entry = self._entry(entry)
+        mm = self.mm
+        start = mm.rfind(b'\n', 0, entry.offset - 1) + 1
+
+        return mm[start + 1:entry.offset].rstrip(b'\r\n')
+
+    def raw(self, entry):
+        """Sequence lines of a record exactly as stored in the file"""
+        entry = self._entry(entry)
+        return self.mm[entry.offset:self._end(entry)]
+
+    def sequence(self, entry):
+        """Sequence of a record as bytes, line breaks removed"""
+        entry = self._entry(entry)
+        return self.raw(entry).translate(None, _WHITESPACE)
+
+    def digest(self, entry):
+        """sha1 of a record's header and sequence (line layout ignored)
+
+        Computed once per record and kept on its entry.
+        """
+        entry = self._entry(entry)
+        if entry.digest is None:
+            sha = hashlib.sha1(self.header(entry))
+            sha.update(b'\n')
+            sha.update(self.sequence(entry))
+            entry.digest = sha.hexdigest()
+
+        return entry.digest
+
+    def write_record(self, entry, outfile):
+        """Copy one record (header and original sequence lines) to outfile"""
+        entry = self._entry(entry)
+        raw = self.raw(entry)
+        outfile.write(b'>' + self.header(entry) + b'\n')
+        outfile.write(raw)
+        if raw and not raw.endswith(b'\n'):
+            outfile.write(b'\n')
+
+    def close(self):
+        """Release the mmap"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._handle.close()
+            self._mmap = self._handle = None
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Fixed-width binned distributions with summary statistics"""
+import json
+
+import numpy as np
+
+
+class Distribution(object):
+    """Counts of integer values in fixed-width bins plus N/mean/max/N50
+
+    Bin i counts values in [i * width, (i + 1) * width). With overflow set,
+    the last bin instead counts every value from its start up. The summary
+    is computed from the exact values, not from the bins.
+    """
+
+    def __init__(self, name, width, counts, summary, overflow=False):
+        self.name = name
+        self.width = width
+        self.counts = counts
+        self.summary = summary
+        self.overflow = overflow
+
+    @classmethod
+    def from_values(cls, name, values, width, nbins=None):
+        """Bin an array of non-negative integers"""
+        values = np.asarray(values)
+        if len(values):
+            valcounts = np.bincount(values)
+        else:
+            valcounts = np.zeros(0, dtype=np.int64)
+        return cls.from_bincount(name, valcounts, width, nbins)
+
+    @classmethod
+    def from_bincount(cls, name, valcounts, width, nbins=None):
+        """Bin a bincount array (valcounts[v] = number of values equal v)
+
+        With nbins, there are exactly nbins bins and the last one is an
+        overflow bin.
+        """
+        valcounts = np.asarray(valcounts, dtype=np.int64)
+        nonzero = np.flatnonzero(valcounts)
+        maximum = int(nonzero[-1]) if len(nonzero) else 0
+        valcounts = valcounts[:maximum + 1]
+
+        fixed = nbins
+        nbins = max(maximum // width + 1, fixed or 0)
+        padded = np.zeros(nbins * width, dtype=np.int64)
+        padded[:len(valcounts)] = valcounts
+        counts = padded.reshape(nbins, width).sum(axis=1)
+        if fixed:
+            counts[fixed - 1] = counts[fixed - 1:].sum()
+            counts = counts[:fixed]
+
+        values = np.arange(len(valcounts), dtype=np.int64)
+        number = int(valcounts.sum())
+        total = int((values * valcounts).sum())
+        # N50: largest value v such that values >= v hold half the total
+        n50 = 0
+        if total:
+            above = np.cumsum((values * valcounts)[::-1])
+            n50 = int(values[::-1][np.searchsorted(above, total / 2.0)])
+
+        summary = {'n': number, 'total': total, 'max': maximum, 'n50': n50,
+                   'mean': float(total) / number if number else 0.0}
+
+        return cls(name, width, counts, summary, overflow=bool(fixed))
+
+    @property
+    def edges(self):
+        """Bin edges, len(counts) + 1 of them"""
+        return np.arange(len(self.counts) + 1, dtype=np.int64) * self.width
+
+    def save(self, prefix):
+        """Write <prefix>.tsv (bins) and <prefix>.json (bins + summary)"""
+        edges = self.edges
+        with open(prefix + '.tsv', 'w') as outfile:
+            outfile.write("bin_start\tbin_end\tcount\n")
+            ends = [str(end) for end in edges[1:]]
+            if self.overflow and ends:
+                ends[-1] = 'inf'
+            for start, end, count in zip(edges[:-1], ends, self.counts):
+                outfile.write("{s}\t{e}\t{c}\n".format(s=start, e=end,
+                                                        c=count))
+        with open(prefix + '.json', 'w') as outfile:
+            json.dump({'name': self.name, 'width': self.width,
+                       'counts': self.counts.tolist(),
+                       'summary': self.summary, 'overflow': self.overflow},
+                      outfile, sort_keys=True)
+
+
+def load_distribution(path):
+    """Read a Distribution written by Distribution.save (the .json)"""
+    with open(path, 'r') as infile:
+        data = json.load(infile)
+
+    return Distribution(data['name'], data['width'],
+                        np.array(data['counts'], dtype=np.int64),
+                        data['summary'], data.get('overflow', False))
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""Per (reference, query) homology scoring over Coords tables"""
+import os
+
+import numpy as np
+
+from falcon_tools.fasta import as_str
+from falcon_tools.intervals import merge_grouped
+
+# A query is homologous to a reference when it has more than MIN_HITS
+# alignments, merged/total alignment ratio above MIN_RATIO and aligned bp
+# covering at least MIN_PERCENT of the reference
+MIN_HITS = 3
+MIN_RATIO = 0.75
+MIN_PERCENT = 0.03
+
+SCORE_DTYPE = np.dtype([('ref', np.int32), ('query', np.int32),
+                        ('hits', np.int32), ('merged', np.int32),
+                        ('total_bp', np.int64), ('percent_ref', np.float64),
+                        ('ratio', np.float64), ('homolog', np.bool_)])
+
+
+def score_coords(coords, ref_length, min_hits=MIN_HITS, min_ratio=MIN_RATIO,
+                 min_percent=MIN_PERCENT):
+    """Score every query aligned to one reference
+
+    Returns a SCORE_DTYPE table with one row per query (ref/query are
+    indexes into coords.names), in query index order. All statistics are
+    group-by aggregations over the query-sorted rows of coords.
+    """
+    rows, queries, offsets = coords.by_query()
+    table = np.zeros(len(queries), dtype=SCORE_DTYPE)
+    if not len(queries):
+        return table
+
+    starts = offsets[:-1]
+    table['ref'] = rows['ref'][starts]
+    table['query'] = queries
+    table['hits'] = np.diff(offsets)
+    table['merged'] = np.diff(
+        merge_grouped(rows['rstart'], rows['rend'], offsets)[2])
+    table['total_bp'] = np.add.reduceat(rows['rlen'].astype(np.int64), starts)
+    # Python's round() rounds the exact binary value, np.round does not;
+    # this is one call per query, not per alignment
+    table['percent_ref'] = [round(value, 4) for value in
+                            (table['total_bp'] / float(ref_length)).tolist()]
+    table['ratio'] = table['merged'] / table['hits'].astype(np.float64)
+    table['homolog'] = ((table['hits'] > min_hits) &
+                        (table['ratio'] > min_ratio) &
+                        (table['percent_ref'] >= min_percent))
+
+    return table
+
+
+def append_scores(path, table, names):
+    """Append a score_coords table and its name table to path
+
+    Returns the (start, end) byte offsets of the entry.
+    """
+    with open(path, 'ab') as outfile:
+        outfile.seek(0, os.SEEK_END)
+        start = outfile.tell()
+        np.save(outfile, np.array(names, dtype=np.str_))
+        np.save(outfile, table)
+        end = outfile.tell()
+
+    return start, end
+
+
+def iter_scores(path, starts):
+    """Yield the (names, table) entries appended to path at each offset"""
+    with open(path, 'rb') as infile:
+        for start in starts:
+            infile.seek(start)
+            names = _names(np.load(infile))
+            yield names, np.load(infile)
+
+
+class HomologyMatrix(object):
+    """Sparse (reference, query) score matrix over every scored pair
+
+    rows is a SCORE_DTYPE table whose ref/query are indexes into names,
+    sorted by (ref, query). ref_ptr is its CSR row index: the pairs of
+    reference i are rows[ref_ptr[i]:ref_ptr[i + 1]]. by_query/query_ptr
+    index the same rows by query, so lookups in either direction are two
+    array slices rather than a scan.
+    """
+
+    def __init__(self, names, rows):
+        self.names = list(names)
+        self._ids = dict((name, idx) for idx, name in enumerate(self.names))
+        order = np.lexsort((rows['query'], rows['ref']))
+        self.rows = rows[order]
+        self.ref_ptr = _csr_pointers(self.rows['ref'], len(self.names))
+        self.by_query = np.argsort(self.rows['query'], kind='mergesort')
+        self.query_ptr = _csr_pointers(self.rows['query'][self.by_query],
+                                       len(self.names))
+
+    @classmethod
+    def from_scores(cls, scores):
+        """Merge (names, table) score tables with their own name tables"""
+        names = []
+        ids = {}
+        tables = []
+        for local_names, table in scores:
+            remap = np.empty(len(local_names), dtype=np.int32)
+            for idx, name in enumerate(local_names):
+                if name not in ids:
+                    ids[name] = len(names)
+                    names.append(name)
+                remap[idx] = ids[name]
+            table = table.copy()
+            table['ref'] = remap[table['ref']]
+            table['query'] = remap[table['query']]
+            tables.append(table)
+
+        if tables:
+            rows = np.concatenate(tables)
+        else:
+            rows = np.zeros(0, dtype=SCORE_DTYPE)
+        return cls(names, rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def pairs(self, name, as_query=False, homologs_only=True):
+        """Score rows with name as the reference (or as the query)"""
+        idx = self._ids.get(name)
+        if idx is None:
+            return self.rows[:0]
+        if as_query:
+            rows = self.rows[self.by_query[
+                self.query_ptr[idx]:self.query_ptr[idx + 1]]]
+        else:
+            rows = self.rows[self.ref_ptr[idx]:self.ref_ptr[idx + 1]]
+        if homologs_only:
+            rows = rows[rows['homolog']]
+        return rows
+
+    def homologs(self, name):
+        """Sorted names of every contig homologous to name, either way"""
+        found = set(self.pairs(name)['query'].tolist())
+        found.update(self.pairs(name, as_query=True)['ref'].tolist())
+
+        return sorted(self.names[idx] for idx in found)
+
+    def save(self, prefix):
+        """Write <prefix>.npz (table + indexes) and <prefix>.tsv"""
+        np.savez(prefix + '.npz', names=np.array(self.names, dtype=np.str_),
+                 rows=self.rows, ref_ptr=self.ref_ptr,
+                 by_query=self.by_query, query_ptr=self.query_ptr)
+        with open(prefix + '.tsv', 'w') as outfile:
+            outfile.write("reference\tquery\thits\tmerged\ttotal_bp\t"
+                          "percent_ref\tratio\thomolog\n")
+            for row in self.rows.tolist():
+                outfile.write("{r}\t{q}\t{h}\t{m}\t{t}\t{p}\t{a:.4f}\t{f}\n"
+                              .format(r=self.names[row[0]],
+                                      q=self.names[row[1]], h=row[2],
+                                      m=row[3], t=row[4], p=row[5],
+                                      a=row[6], f=int(row[7])))
+
+
+def load_matrix(path):
+    """Read a HomologyMatrix written by HomologyMatrix.save (the .npz)"""
+    data = np.load(path)
+    try:
+        matrix = HomologyMatrix.__new__(HomologyMatrix)
+        matrix.names = _names(data['names'])
+        matrix._ids = dict((name, idx)
+                           for idx, name in enumerate(matrix.names))
+        matrix.rows = data['rows']
+        matrix.ref_ptr = data['ref_ptr']
+        matrix.by_query = data['by_query']
+        matrix.query_ptr = data['query_ptr']
+    finally:
+        data.close()
+
+    return matrix
+
+
+def _csr_pointers(keys, size):
+    """Offsets of each key's run in a key-sorted array"""
+    pointers = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=size), out=pointers[1:])
+
+    return pointers
+
+
+def _names(array):
+    """Saved name array -> list of native str (py2 writes bytes)"""
+    return [as_str(name) for name in array.tolist()]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""Vectorized interval union over integer start/end arrays
+
+Intervals are closed and intervals that touch (start == previous end) are
+merged, matching the endpoint-sweep merge used by get_homologs.
+"""
+import numpy as np
+
+
+def merge_intervals(starts, ends):
+    """Merge overlapping intervals; returns (merged starts, merged ends)"""
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if not len(starts):
+        return starts[:0], ends[:0]
+
+    order = np.argsort(starts, kind='mergesort')
+    starts = starts[order]
+    reach = np.maximum.accumulate(ends[order])
+
+    first = np.empty(len(starts), dtype=bool)
+    first[0] = True
+    first[1:] = starts[1:] > reach[:-1]
+    heads = np.flatnonzero(first)
+    tails = np.append(heads[1:], len(starts)) - 1
+
+    return starts[heads], reach[tails]
+
+
+def merge_grouped(starts, ends, offsets):
+    """Merge intervals of many groups in one call
+
+    Group i owns starts/ends[offsets[i]:offsets[i + 1]]. Returns
+    (merged starts, merged ends, merged offsets) using the same layout.
+    Coordinates must be non-negative.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ngroups = len(offsets) - 1
+    if not len(starts):
+        return starts[:0], ends[:0], np.zeros(ngroups + 1, dtype=np.int64)
+
+    groups = np.repeat(np.arange(ngroups, dtype=np.int64), np.diff(offsets))
+
+    # Lift each group into its own disjoint coordinate range: one sort then
+    # orders by (group, start) and a single running max never carries an
+    # end coordinate across a group boundary
+    span = max(int(ends.max()), int(starts.max())) + 1
+    lift = groups * span
+    order = np.argsort(starts + lift, kind='mergesort')
+    starts = starts[order]
+    groups = groups[order]
+    lift = lift[order]
+    reach = np.maximum.accumulate(ends[order] + lift) - lift
+
+    first = np.empty(len(starts), dtype=bool)
+    first[0] = True
+    first[1:] = (groups[1:] != groups[:-1]) | (starts[1:] > reach[:-1])
+    heads = np.flatnonzero(first)
+    tails = np.append(heads[1:], len(starts)) - 1
+
+    counts = np.bincount(groups[heads], minlength=ngroups)
+    merged_offsets = np.zeros(ngroups + 1, dtype=np.int64)
+    np.cumsum(counts, out=merged_offsets[1:])
+
+    return starts[heads], reach[tails], merged_offsets
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""Append-only run manifest for resumable pipelines"""
+import os
+import json
+
+from falcon_tools.cache import file_digest
+
+
+class RunManifest(object):
+    """Record completed (item, stage) outputs with checksums
+
+    Every completed stage is appended as one JSON line, so an interrupted
+    run loses at most the line being written. The first line holds the run
+    parameters; a manifest written with different parameters is discarded.
+
+    A stage counts as done when its output still exists with the recorded
+    checksum and it was produced from the same upstream input (usually the
+    checksum of the previous stage's output).
+    """
+
+    def __init__(self, path, params, log, restart=False):
+        self.path = path
+        self.log = log
+        self.stages = {}
+        params = json.loads(json.dumps(params))
+
+        if os.path.exists(path) and not restart:
+            with open(path, 'r') as infile:
+                lines = infile.readlines()
+            header = _loads(lines[0]) if lines else None
+            if header is not None and header.get('params') == params:
+                for line in lines[1:]:
+                    record = _loads(line)
+                    if record is not None:
+                        self.stages[(record['item'], record['stage'])] = record
+                log.info("Resuming from %s (%d completed stages)",
+                         path, len(self.stages))
+            else:
+                log.info("Run parameters changed, ignoring %s", path)
+
+        # Compact the surviving records into a fresh file, then append
+        tmp = path + '.tmp'
+        self._out = open(tmp, 'w')
+        self._write({'params': params})
+        for record in self.stages.values():
+            self._write(record)
+        self._out.close()
+        os.rename(tmp, path)
+        self._out = open(path, 'a')
+
+    def _write(self, record):
+        self._out.write(json.dumps(record, sort_keys=True) + '\n')
+        self._out.flush()
+        os.fsync(self._out.fileno())
+
+    def done(self, item, stage, upstream=None):
+        """Return the stage record if its output is complete and current"""
+        record = self.stages.get((item, stage))
+        if record is None or record.get('upstream') != upstream:
+            return None
+        output = record['output']
+        if output is not None:
+            if not os.path.exists(output) or \
+                    file_digest(output) != record['sha1']:
+                self.log.debug("Stale %s output for %s: %s",
+                               stage, item, output)
+                return None
+
+        return record
+
+    def record(self, item, stage, output, upstream=None, **extra):
+        """Mark a stage complete; returns the new record"""
+        record = dict(extra)
+        record.update({'item': item, 'stage': stage, 'output': output,
+                       'upstream': upstream,
+                       'sha1': file_digest(output) if output else None})
+        self.stages[(item, stage)] = record
+        self._write(record)
+
+        return record
+
+    def close(self):
+        """Close the manifest file"""
+        self._out.close()
+
+
+def _loads(line):
+    """Parse one manifest line; a truncated trailing line reads as None"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""FracMinHash k-mer sketches for cheap containment between sequences"""
+import multiprocessing
+
+import numpy as np
+
+DEFAULT_K = 21
+# keep hashes below 2**64 / scale: about one k-mer in every `scale`
+DEFAULT_SCALE = 200
+# bases hashed per numpy pass, bounding memory on long contigs
+WINDOW = 1 << 22
+
+_MAX_HASH = (1 << 64) - 1
+# A/C/G/T (any case) -> 0..3, anything else -> 4
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _base, _code in zip('ACGTacgt', (0, 1, 2, 3, 0, 1, 2, 3)):
+    _CODES[ord(_base)] = _code
+
+
+def _mix(values):
+    """murmur3 64-bit finalizer, in place on a uint64 array"""
+    values ^= values >> np.uint64(33)
+    values *= np.uint64(0xff51afd7ed558ccd)
+    values ^= values >> np.uint64(33)
+    values *= np.uint64(0xc4ceb9fe1a85ec53)
+    values ^= values >> np.uint64(33)
+
+    return values
+
+
+def kmer_hashes(sequence, k=DEFAULT_K):
+    """Hashes of every canonical k-mer (k <= 32) of a bytes sequence
+
+    K-mers spanning a non-ACGT base are skipped. Forward and reverse
+    complement codes are built with one shift-or pass per k-mer position,
+    so the cost is k vectorised passes over the sequence.
+    """
+    codes = _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+    count = len(codes) - k + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ambiguous = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == 4, out=ambiguous[1:])
+    valid = ambiguous[k:] == ambiguous[:-k]
+    codes = np.minimum(codes, 3).astype(np.uint64)
+
+    forward = np.zeros(count, dtype=np.uint64)
+    reverse = np.zeros(count, dtype=np.uint64)
+    for pos in range(k):
+        part = codes[pos:pos + count]
+        forward <<= np.uint64(2)
+        forward |= part
+        reverse |= (np.uint64(3) - part) << np.uint64(2 * pos)
+
+    return _mix(np.minimum(forward, reverse)[valid])
+
+
+def sketch_sequence(sequence, k=DEFAULT_K, scale=DEFAULT_SCALE):
+    """Sorted unique k-mer hashes below 2**64 / scale (a FracMinHash)"""
+    threshold = np.uint64(_MAX_HASH // scale)
+    kept = []
+    for start in range(0, max(len(sequence) - k + 1, 0), WINDOW):
+        hashes = kmer_hashes(sequence[start:start + WINDOW + k - 1], k)
+        kept.append(hashes[hashes < threshold])
+    if not kept:
+        return np.zeros(0, dtype=np.uint64)
+
+    return np.unique(np.concatenate(kept))
+
+
+# Index and parameters of the running sketch pool
+_SKETCH_JOB = [None]
+
+
+def _set_sketch_job(index, k, scale):
+    """Pool initializer for _sketch_record"""
+    _SKETCH_JOB[0] = (index, k, scale)
+
+
+def _sketch_record(name):
+    """Pool worker: sketch one record of the shared index"""
+    index, k, scale = _SKETCH_JOB[0]
+    return sketch_sequence(index.sequence(name), k, scale)
+
+
+class SketchIndex(object):
+    """Sketches of many sequences, searchable by shared hashes
+
+    All hashes are kept in one sorted array with the index of the sequence
+    they came from, so the hashes a sketch shares with every sequence are
+    counted with two searchsorted calls and a bincount.
+    """
+
+    def __init__(self, names, sketches):
+        self.names = list(names)
+        self.sketches = list(sketches)
+        self.sizes = np.array([len(sketch) for sketch in self.sketches],
+                              dtype=np.int64)
+        if self.sketches:
+            hashes = np.concatenate(self.sketches)
+        else:
+            hashes = np.zeros(0, dtype=np.uint64)
+        owners = np.repeat(np.arange(len(self.names), dtype=np.int64),
+                           self.sizes)
+        order = np.argsort(hashes, kind='mergesort')
+        self.hashes = hashes[order]
+        self.owners = owners[order]
+
+    @classmethod
+    def from_index(cls, index, k=DEFAULT_K, scale=DEFAULT_SCALE, nproc=1):
+        """Sketch every record of a FastaIndex"""
+        names = [entry.name for entry in index]
+        if nproc > 1 and len(names) > 1:
+            pool = multiprocessing.Pool(nproc, _set_sketch_job,
+                                        (index, k, scale))
+            try:
+                sketches = pool.map(_sketch_record, names)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            _set_sketch_job(index, k, scale)
+            sketches = [_sketch_record(name) for name in names]
+
+        return cls(names, sketches)
+
+    def shared(self, sketch):
+        """Number of hashes of sketch found in each indexed sequence"""
+        left = np.searchsorted(self.hashes, sketch, 'left')
+        counts = np.searchsorted(self.hashes, sketch, 'right') - left
+        total = int(counts.sum())
+        if not total:
+            return np.zeros(len(self.names), dtype=np.int64)
+        # positions of every match: each run left[i]:left[i] + counts[i]
+        runs = np.repeat(left - (np.cumsum(counts) - counts), counts)
+        matches = runs + np.arange(total, dtype=np.int64)
+
+        return np.bincount(self.owners[matches], minlength=len(self.names))
+
+    def candidates(self, min_containment):
+        """{name: names whose containment with it, either way, may pass}
+
+        j is a candidate of i when their shared hashes are at least
+        min_containment of the smaller sketch (and at least one). The
+        relation is symmetric. Sequences too short to have any hash in
+        their sketch cannot be judged and are candidates of everything.
+        """
+        empty = self.sizes == 0
+        result = {}
+        for idx, name in enumerate(self.names):
+            if empty[idx]:
+                result[name] = list(self.names)
+                continue
+            needed = np.maximum(
+                np.ceil(min_containment * np.minimum(self.sizes,
+                                                     self.sizes[idx])), 1)
+            keep = (self.shared(self.sketches[idx]) >= needed) | empty
+            keep[idx] = True
+            result[name] = [self.names[other]
+                            for other in np.flatnonzero(keep).tolist()]
+
+        return result
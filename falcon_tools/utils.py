@@ -1,22 +1,42 @@
 """Misc utilities"""
 import os
 import sys
+import re
 import csv
-import glob
+import gzip
+import shutil
 import logging
+import tempfile
+import threading
+import contextlib
 import subprocess
+import collections
+import multiprocessing
 
-import pbcore.io.FastaIO as fi
+from falcon_tools.fasta import FastaIndex, as_str
+
+# read size of iter_blocks and the streaming parsers built on it
+BLOCK_SIZE = 1 << 24
+# trailing stderr lines kept from a streamed command for logs and errors
+STDERR_LINES = 1000
+GZIP_LEVEL = 1
+# smallest byte range handed to a clean_fasta_parallel worker
+MIN_CHUNK = 1 << 26
+
+# Both patterns start with a literal newline so the regex engine can
+# skip ahead with a fast substring search
+_BLANK_LINES = re.compile(br'\n[ \t\r]*(?=\n)')
+_EMPTY_RECORD = re.compile(br'\n>([^\n]*)(?=\n>)')
 
 
 def setup_log(alog, level=logging.INFO, file_name=None, log_filter=None,
               str_formatter='[%(levelname)s] %(asctime)-15s '
                             '[%(name)s %(funcName)s %(lineno)d] '
-                            '%(message)s'):
+                            '%(message)s', stream=None):
     """Core Util to setup log handler"""
     alog.setLevel(logging.DEBUG)
     if file_name is None:
-        handler = logging.StreamHandler(sys.stdout)
+        handler = logging.StreamHandler(stream or sys.stdout)
     else:
         handler = logging.FileHandler(file_name)
     formatter = logging.Formatter(str_formatter)
@@ -27,65 +47,381 @@ def setup_log(alog, level=logging.INFO, file_name=None, log_filter=None,
     alog.addHandler(handler)
 
 
-def run(cmd, cwd, log):
-    """Run shell process"""
+class CommandTimeout(RuntimeError):
+    """A streamed command outlived its timeout and was killed"""
+
+
+class CommandError(subprocess.CalledProcessError):
+    """CalledProcessError that survives pickling (py2's does not), so it
+    reaches the parent of a multiprocessing pool worker"""
+
+    def __reduce__(self):
+        return (type(self), (self.returncode, self.cmd, self.output))
+
+
+def _drain(pipe, lines):
+    """Read a pipe to EOF, keeping its last lines"""
+    for line in iter(pipe.readline, pipe.read(0)):
+        lines.append(line)
+
+
+def _kill(process, expired=None):
+    """Kill a process that may already have exited"""
+    if expired is not None:
+        expired.append(True)
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def stream_cmd(cmd, cwd, log, timeout=None, text=False,
+               stdout=subprocess.PIPE):
+    """Run cmd and yield its stdout pipe for incremental reading
+
+    Pass an open file as stdout to redirect the output there instead
+    (None is yielded).
+
+    stderr is drained on a background thread, so neither pipe can fill up
+    and stall the command, and is logged at debug once it exits. Leaving
+    the block waits for the command: a non-zero exit raises CommandError,
+    a CalledProcessError (output holds the stderr tail), and running longer
+    than timeout seconds kills it and raises CommandTimeout. If the block
+    raises, the command is killed.
+    """
     log.debug("Running cmd %s", cmd)
+    process = subprocess.Popen(cmd, stdout=stdout, stderr=subprocess.PIPE,
+                               cwd=cwd, universal_newlines=text)
+    lines = collections.deque(maxlen=STDERR_LINES)
+    drain = threading.Thread(target=_drain, args=(process.stderr, lines))
+    drain.daemon = True
+    drain.start()
+
+    expired = []
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, _kill, (process, expired))
+        timer.daemon = True
+        timer.start()
 
-    process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
-    stdout, stderr = process.communicate()
+    try:
+        yield process.stdout
+    except BaseException:
+        _kill(process)
+        raise
+    finally:
+        if process.stdout is not None:
+            process.stdout.close()
+        returncode = process.wait()
+        if timer is not None:
+            timer.cancel()
+        drain.join()
+        process.stderr.close()
 
+    stderr = as_str(lines[0][:0].join(lines)) if lines else ''
     if stderr:
         log.debug(stderr)
+    if expired:
+        raise CommandTimeout("{c} timed out after {t} s".format(
+            c=' '.join(cmd), t=timeout))
+    if returncode:
+        raise CommandError(returncode, cmd, output=stderr)
+
+
+def run_to_file(cmd, cwd, log, path, timeout=None):
+    """Run cmd with its stdout redirected straight into the file at path
+
+    The output never passes through Python. A partial file is removed if
+    the command fails.
+    """
+    try:
+        with open(path, 'wb') as outfile:
+            with stream_cmd(cmd, cwd, log, timeout, stdout=outfile):
+                pass
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+def iter_lines(cmd, cwd, log, timeout=None):
+    """Yield the stdout lines of cmd, as text, while it runs"""
+    with stream_cmd(cmd, cwd, log, timeout, text=True) as stdout:
+        for line in stdout:
+            yield line
+
+
+def iter_chunks(cmd, cwd, log, blocksize=BLOCK_SIZE, timeout=None):
+    """Yield the stdout of cmd in byte chunks of up to blocksize"""
+    with stream_cmd(cmd, cwd, log, timeout) as stdout:
+        for chunk in iter(lambda: stdout.read(blocksize), b''):
+            yield chunk
+
+
+def iter_blocks(stream, blocksize=BLOCK_SIZE, limit=None):
+    """Yield blocks of whole lines from a binary stream
+
+    Every block starts and ends with a newline (one is added after a last
+    line without it), so each line, the first included, can be matched as
+    '\n...' up to a following '\n'. Reads at most limit bytes if given.
+    """
+    carry = b''
+    remaining = limit
+    while True:
+        size = blocksize if remaining is None else min(blocksize, remaining)
+        data = stream.read(size) if size > 0 else b''
+        if not data:
+            if carry:
+                yield b'\n' + carry + b'\n'
+            return
+        if remaining is not None:
+            remaining -= len(data)
+
+        block = b'\n' + carry + data
+        cut = block.rfind(b'\n') + 1
+        block, carry = block[:cut], block[cut:]
+        if len(block) > 1:
+            yield block
+
+
+class CleanStats(object):
+    """Counters reported by clean_stream"""
+
+    def __init__(self):
+        self.records = 0
+        self.dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def bytes_dropped(self):
+        """Bytes removed: empty records, blank lines and leading junk"""
+        return self.bytes_in - self.bytes_out
+
+
+def _open_fasta(path, mode):
+    """Open a fasta for binary streaming; '-' is stdin/stdout, *.gz is gzip"""
+    if path == '-':
+        stream = sys.stdin if 'r' in mode else sys.stdout
+        return getattr(stream, 'buffer', stream)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b', GZIP_LEVEL)
+    return open(path, mode + 'b')
 
-    return stdout.rstrip(), stderr
 
+def _drop_empty(block, stats, log, dropped_headers=None):
+    """Remove header lines directly followed by another header"""
+    dropped = _EMPTY_RECORD.findall(block)
+    if not dropped:
+        return block
+    for header in dropped:
+        if dropped_headers is None:
+            log.info("Dropped!: %s", as_str(header.rstrip()))
+        else:
+            dropped_headers.append(as_str(header.rstrip()))
+    stats.dropped += len(dropped)
 
-def clean_fasta(fastafile, log):
-    """Check fasta for 0 length sequences / blank lines and clean it up"""
+    return _EMPTY_RECORD.sub(b'', block)
+
+
+def clean_stream(infile, outfile, log, limit=None, blocksize=BLOCK_SIZE,
+                 dropped=None):
+    """Copy fasta from infile to outfile without empty records or blank lines
+
+    Works on large byte blocks: blank lines and empty records are removed
+    with regular expressions over the whole block, so sequences are never
+    split into lines or decoded. Reads at most limit bytes if given.
+    Headers of dropped records are logged, or appended to the dropped
+    list if one is given. Returns a CleanStats.
+    """
+    stats = CleanStats()
+    held = b''
+    started = False
+
+    for block in iter_blocks(infile, blocksize, limit):
+        stats.bytes_in += len(block) - 1
+        block = _BLANK_LINES.sub(b'', b'\n' + held + block[1:])
+        held = b''
+        if not started:
+            # Anything before the first header is not part of a record
+            first = block.find(b'\n>')
+            if first < 0:
+                continue
+            block = block[first:]
+            started = True
+
+        # Headers on the last lines may still get their sequence from the
+        # next block, so hold them back
+        tail = len(block)
+        while tail > 1:
+            last = block.rfind(b'\n', 0, tail - 1) + 1
+            if block[last:last + 1] != b'>':
+                break
+            tail = last
+        block, held = block[:tail], block[tail:]
+
+        stats.records += block.count(b'\n>')
+        block = _drop_empty(block, stats, log, dropped)
+        outfile.write(block[1:])
+        stats.bytes_out += len(block) - 1
+
+    # Headers still held at the end of the input have no sequence
+    if held:
+        stats.records += held.count(b'\n')
+        _drop_empty(b'\n' + held + b'>', stats, log, dropped)
+
+    return stats
+
+
+def split_fasta_ranges(fastafile, nchunks):
+    """Split a fasta into ~equal (start, end) byte ranges on record starts"""
+    size = os.path.getsize(fastafile)
+    bounds = [0]
+    with open(fastafile, 'rb') as infile:
+        for idx in range(1, nchunks):
+            pos = max(bounds[-1], size * idx // nchunks)
+            infile.seek(pos)
+            window = b'\n' if pos == 0 else b''
+            while True:
+                data = infile.read(1 << 20)
+                window = window[-1:] + data
+                found = window.find(b'\n>')
+                if found >= 0:
+                    pos += found + 1 - (len(window) - len(data))
+                    break
+                if not data:
+                    pos = size
+                    break
+                pos += len(data)
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _clean_range(job):
+    """Pool worker: clean one byte range of a fasta into a part file"""
+    fastafile, start, end, part = job
+    dropped = []
+    with open(fastafile, 'rb') as infile:
+        infile.seek(start)
+        with open(part, 'wb') as outfile:
+            stats = clean_stream(infile, outfile, None, limit=end - start,
+                                 dropped=dropped)
+
+    return (stats.records, stats.dropped, stats.bytes_in, stats.bytes_out,
+            dropped)
+
+
+def clean_fasta_parallel(fastafile, outfile, log, nproc):
+    """Clean a plain-text fasta with nproc processes; returns a CleanStats
+
+    The file is split into byte ranges at record starts, each range is
+    cleaned into a part file, and the parts are appended to outfile in
+    their original order, so the output is identical to clean_stream's.
+    """
+    nchunks = max(1, min(nproc * 4, os.path.getsize(fastafile) // MIN_CHUNK))
+    ranges = split_fasta_ranges(fastafile, nchunks)
+    log.info("Cleaning %d chunks with %d processes", len(ranges), nproc)
+
+    tmpdir = tempfile.mkdtemp(prefix='clean_fasta.', dir=os.getcwd())
+    jobs = [(fastafile, start, end,
+             os.path.join(tmpdir, "part_{i:05d}.fa".format(i=idx)))
+            for idx, (start, end) in enumerate(ranges)]
+    stats = CleanStats()
+    pool = multiprocessing.Pool(nproc)
+    try:
+        for job, result in zip(jobs, pool.imap(_clean_range, jobs)):
+            records, dropped, bytes_in, bytes_out, headers = result
+            for header in headers:
+                log.info("Dropped!: %s", header)
+            stats.records += records
+            stats.dropped += dropped
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            with open(job[3], 'rb') as part:
+                shutil.copyfileobj(part, outfile, BLOCK_SIZE)
+            os.remove(job[3])
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return stats
+
+
+def clean_fasta(fastafile, log, output=None, nproc=1):
+    """Check fasta for 0 length sequences / blank lines and clean it up
+
+    fastafile and output may be gzipped (*.gz) or '-' for stdin/stdout.
+    With nproc > 1 an uncompressed fastafile is cleaned in parallel.
+    """
     log.info("Cleaning fasta: %s", fastafile)
-    reads = fi.FastaReader(fastafile)
-    output = "{x}_cleaned.fa".format(
-        x=os.path.basename(fastafile).split('.', 1)[0])
-    with open(output, 'w') as outfile:
-        for record in reads:
-            if record.sequence:
-                outfile.write('>{r}\n{s}\n'.format(
-                    r=record.header, s=record.sequence))
-            else:
-                log.info("Dropped!: %s", record.header)
+    if output is None:
+        if fastafile == '-':
+            output = '-'
+        else:
+            output = "{x}_cleaned.fa".format(
+                x=os.path.basename(fastafile).split('.', 1)[0])
+
+    parallel = nproc > 1 and fastafile != '-' and \
+        not fastafile.endswith('.gz')
+    if nproc > 1 and not parallel:
+        log.info("Input is not seekable, cleaning with a single process")
+
+    outfile = _open_fasta(output, 'w')
+    try:
+        if parallel:
+            stats = clean_fasta_parallel(fastafile, outfile, log, nproc)
+        else:
+            infile = _open_fasta(fastafile, 'r')
+            try:
+                stats = clean_stream(infile, outfile, log)
+            finally:
+                if fastafile != '-':
+                    infile.close()
+    finally:
+        if output != '-':
+            outfile.close()
+        else:
+            outfile.flush()
+
+    log.info("Kept %d of %d records; dropped %d empty records "
+             "(%d bytes removed)", stats.records - stats.dropped,
+             stats.records, stats.dropped, stats.bytes_dropped)
 
     return output
 
 
-def explode_fasta(fasta, log):
+def reference_paths(index, outdir="fastas"):
+    """(exploded fasta path, sequence ID) of every record in an index"""
+    paths = []
+    for record in index:
+        fname = as_str(index.header(record)).rstrip().rstrip('|arrow')
+        paths.append((os.path.join(outdir, "{s}.fasta".format(s=fname)),
+                      record.name))
+
+    return paths
+
+
+def explode_fasta(fasta, log, index=None):
     """split input fasta into individuals"""
-    in_file = False
     outdir = "fastas"
 
     if not os.path.exists(outdir):
         os.mkdir(outdir)
+    if index is None:
+        index = FastaIndex.open(fasta, log)
 
-    with open(fasta, 'r') as infile:
-
-        for line in infile:
-            if line.startswith(">"):
-                if in_file:
-                    outfile.close()
-
-                fname = line.rstrip().partition(">")[2].rstrip('|arrow')
-                fname = "{s}.fasta".format(s=fname)
-                fout = os.path.join(outdir, fname)
-                outfile = open(fout, "w")
-                in_file = True
-
-                outfile.write(line)
-            elif in_file:
-                outfile.write(line)
-            else:
-                log.debug("Line %r, but no previous > found ")
+    fastas = []
+    for fout, name in reference_paths(index, outdir):
+        with open(fout, 'wb') as outfile:
+            index.write_record(name, outfile)
+        fastas.append(fout)
 
-    return glob.glob('fastas/*')
+    return fastas
 
 
 def write_qfile(reference, contigs, length_dict, log):